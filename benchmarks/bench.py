@@ -0,0 +1,235 @@
+# Replays scripted keystrokes through a headless TinyEditor and times file
+# open/save, then writes the results as JSON:
+#
+#   python3 benchmarks/bench.py --output before.json
+#   python3 benchmarks/bench.py --output after.json --compare before.json
+#
+# Latencies are per burst of input (one key while typing, a whole paste),
+# measured from the keys arriving until the editor waits for input again.
+import argparse
+import curses
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from headless import HeadlessScreen, HeadlessTerminal
+from tindit import PASTE_END, PASTE_START, TinyEditor
+
+SIZES = {"1K": 1 << 10, "1M": 1 << 20, "16M": 16 << 20, "128M": 128 << 20, "1G": 1 << 30}
+SOURCE_LINE = "    result = compute_value(items[index], offset=42)  # keep going\n"
+
+def summarize(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {"count": 0}
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": sum(samples) / len(samples) * 1000,
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": samples[-1] * 1000,
+    }
+
+def write_file(path, size):
+    line = SOURCE_LINE.encode()
+    block = line * max(1, (1 << 20) // len(line))
+    with open(path, "wb") as f:
+        written = 0
+        while written < size:
+            chunk = block[:size - written]
+            f.write(chunk)
+            written += len(chunk)
+
+def timed(editor, name, samples):
+    # Wrap a bound method on the instance so the editor's own calls are timed
+    method = getattr(editor, name)
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - start)
+    setattr(editor, name, wrapper)
+
+def replay(path, bursts):
+    screen = HeadlessScreen(bursts=bursts + [("quit", [27, 27])])
+    term = HeadlessTerminal(screen)
+    editor = TinyEditor(term)
+    editor.open_file(path)
+    renders = []
+    timed(editor, "display_file", renders)
+    start = time.perf_counter()
+    editor.run()
+    total = time.perf_counter() - start
+    latencies = {}
+    for label, seconds in screen.latencies:
+        if label != "quit":
+            latencies.setdefault(label, []).append(seconds)
+    result = {label: summarize(samples) for label, samples in latencies.items()}
+    result["render"] = summarize(renders)
+    result["frames"] = term.updates
+    result["total_s"] = total
+    return result
+
+def keys(text):
+    return [10 if char == "\n" else ord(char) for char in text]
+
+def typing_script(count):
+    text = "value = compute(items[index]) + offset\n" * (count // 39 + 1)
+    return [("key", [key]) for key in keys(text[:count])]
+
+def movement_script(count):
+    pattern = [curses.KEY_DOWN] * 20 + [curses.KEY_NPAGE] * 3 + [curses.KEY_RIGHT] * 10 + [curses.KEY_UP] * 15 + [curses.KEY_PPAGE]
+    return [("move", [pattern[i % len(pattern)]]) for i in range(count)]
+
+def snippet_script(count):
+    # "hello" is one of the default snippets; Enter expands the suggestion
+    bursts = []
+    for _ in range(count):
+        bursts += [("key", [key]) for key in keys("hel")]
+        bursts.append(("expand", [10]))
+        bursts.append(("key", [10]))
+    return bursts
+
+def paste_script(count, lines):
+    body = keys("pasted line with some text in it\n" * lines)
+    return [("paste", PASTE_START + body + PASTE_END) for _ in range(count)]
+
+def undo_script(count):
+    return typing_script(count) + [("undo", [26]) for _ in range(count)] + [("redo", [25]) for _ in range(count)]
+
+def scenarios(workdir, quick):
+    lines = 2000 if quick else 20000
+    path = os.path.join(workdir, "edit.py")
+    results = {}
+    for name, script in (
+        ("typing", typing_script(500 if quick else 3000)),
+        ("movement", movement_script(500 if quick else 3000)),
+        ("snippet", snippet_script(50 if quick else 300)),
+        ("paste", paste_script(5 if quick else 20, 1000)),
+        ("undo", undo_script(200 if quick else 1000)),
+    ):
+        with open(path, "w") as f:
+            f.write(SOURCE_LINE * lines)
+        results[name] = replay(path, script)
+    return results
+
+def file_throughput(workdir, max_size):
+    results = []
+    for label, size in SIZES.items():
+        if size > max_size:
+            break
+        path = os.path.join(workdir, f"file_{label}.txt")
+        if shutil.disk_usage(workdir).free < size * 3:
+            results.append({"size": label, "skipped": "not enough free disk space"})
+            continue
+        write_file(path, size)
+        screen = HeadlessScreen()
+        editor = TinyEditor(HeadlessTerminal(screen))
+        start = time.perf_counter()
+        editor.open_file(path)
+        opened = time.perf_counter()
+        editor.display_file()
+        first_frame = time.perf_counter()
+        editor.content.finish_loading()
+        loaded = time.perf_counter()
+        editor.save_file()
+        editor.wait_for_save()
+        saved = time.perf_counter()
+        editor.content.close()
+        mb = size / (1 << 20)
+        results.append({
+            "size": label,
+            "bytes": size,
+            "lines": len(editor.content),
+            "open_ms": (opened - start) * 1000,
+            "first_frame_ms": (first_frame - start) * 1000,
+            "load_ms": (loaded - start) * 1000,
+            "load_mb_s": mb / max(loaded - start, 1e-9),
+            "save_ms": (saved - loaded) * 1000,
+            "save_mb_s": mb / max(saved - loaded, 1e-9),
+        })
+        os.remove(path)
+    return results
+
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+def compare(old, new, prefix=""):
+    # Print every timing that exists in both results with its ratio
+    for key, value in new.items():
+        if key not in old:
+            continue
+        if isinstance(value, dict):
+            compare(old[key], value, f"{prefix}{key}.")
+        elif isinstance(value, list):
+            for before, after in zip(old[key], value):
+                if isinstance(after, dict) and "size" in after:
+                    compare(before, after, f"{prefix}{key}.{after['size']}.")
+        elif key.endswith("_ms") and old[key]:
+            print(f"{prefix}{key}: {old[key]:.3f} -> {value:.3f} ({value / old[key]:.2f}x)")
+
+def parse_size(text):
+    text = text.upper()
+    if text in SIZES:
+        return SIZES[text]
+    return int(text)
+
+def main():
+    parser = argparse.ArgumentParser(description="tindit benchmarks")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    parser.add_argument("--max-size", default="1G", help="largest file for the open/save benchmark (1K, 1M, 16M, 128M, 1G)")
+    parser.add_argument("--quick", action="store_true", help="shorter keystroke scripts and files up to 16M")
+    args = parser.parse_args()
+
+    max_size = parse_size(args.max_size)
+    if args.quick:
+        max_size = min(max_size, SIZES["16M"])
+    workdir = tempfile.mkdtemp(prefix="tindit-bench-")
+    # Keep the user's configuration and snippets out of the measurements
+    os.environ["TINDIT_CONFIG_DIR"] = os.path.join(workdir, "config")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        results = {
+            "meta": metadata(),
+            "scenarios": scenarios(workdir, args.quick),
+            "files": file_throughput(workdir, max_size),
+        }
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
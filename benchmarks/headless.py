@@ -0,0 +1,146 @@
+# In-memory stand-ins for a curses window and the curses module, so the
+# editor can be driven without a terminal:
+#
+#   screen = HeadlessScreen(bursts=[("type", [ord('a')]), ("quit", [27, 27])])
+#   TinyEditor(HeadlessTerminal(screen)).run()
+#
+# Input is a list of (label, keys) bursts. A burst arrives all at once, like
+# a paste or a fast typist, and the next one only arrives when the editor
+# waits for input again. The time from a burst arriving until the editor
+# asks for more input is recorded as its latency.
+import time
+from collections import deque
+
+class HeadlessScreen:
+    def __init__(self, height=40, width=120, bursts=()):
+        self.height = height
+        self.width = width
+        self.bursts = deque(bursts)
+        self.pending = deque()
+        self.label = None
+        self.arrived = None
+        self.draining = False
+        self.delay = -1
+        self.latencies = []  # (label, seconds) per burst
+        self.rows = [" " * width for _ in range(height)]
+        self.cursor = (0, 0)
+
+    def getmaxyx(self):
+        return (self.height, self.width)
+
+    def getch(self):
+        if self.pending:
+            return self.pending.popleft()
+        if self.draining:
+            return -1
+        if self.arrived is not None:
+            self.latencies.append((self.label, time.perf_counter() - self.arrived))
+            self.arrived = None
+        if not self.bursts:
+            if self.delay == -1:
+                raise EOFError("keystroke script ended while the editor waits for input")
+            return -1
+        self.label, keys = self.bursts.popleft()
+        self.pending.extend(keys)
+        self.arrived = time.perf_counter()
+        return self.pending.popleft()
+
+    def getstr(self, y, x):
+        keys = []
+        while self.pending and self.pending[0] != 10:
+            keys.append(self.pending.popleft())
+        return bytes(keys)
+
+    def nodelay(self, flag):
+        self.draining = flag
+
+    def timeout(self, delay):
+        self.draining = False
+        self.delay = delay
+
+    def keypad(self, flag):
+        pass
+
+    def idlok(self, flag):
+        pass
+
+    def move(self, y, x):
+        self.cursor = (y, x)
+
+    def addstr(self, y, x, text, attr=0):
+        row = self.rows[y]
+        self.rows[y] = (row[:x] + text + row[x + len(text):])[:self.width]
+        self.cursor = (y, x + len(text))
+
+    def clrtoeol(self):
+        y, x = self.cursor
+        self.rows[y] = self.rows[y][:x].ljust(self.width)
+
+    def erase(self):
+        self.rows = [" " * self.width for _ in range(self.height)]
+
+    clear = erase
+
+    def insdelln(self, count):
+        y = self.cursor[0]
+        if count < 0:
+            del self.rows[y:y - count]
+            self.rows += [" " * self.width for _ in range(-count)]
+        else:
+            self.rows[y:y] = [" " * self.width for _ in range(count)]
+            del self.rows[self.height:]
+
+    def noutrefresh(self):
+        pass
+
+    def refresh(self):
+        pass
+
+    def text(self):
+        return "\n".join(row.rstrip() for row in self.rows)
+
+class HeadlessTerminal:
+    COLORS = 256
+
+    def __init__(self, screen):
+        self.screen = screen
+        self.updates = 0
+
+    def initscr(self):
+        return self.screen
+
+    def doupdate(self):
+        self.updates += 1
+
+    def color_pair(self, number):
+        return number << 8
+
+    def init_pair(self, number, fg, bg):
+        pass
+
+    def napms(self, ms):
+        pass
+
+    def curs_set(self, visibility):
+        pass
+
+    def noecho(self):
+        pass
+
+    def echo(self):
+        pass
+
+    def raw(self):
+        pass
+
+    def noraw(self):
+        pass
+
+    def start_color(self):
+        pass
+
+    def use_default_colors(self):
+        pass
+
+    def endwin(self):
+        pass
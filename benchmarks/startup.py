@@ -0,0 +1,114 @@
+# Measures time-to-first-frame: each run starts a fresh interpreter that
+# runs tindit.py the way "python3 tindit.py" does, with main() on a headless
+# terminal, and exits at the first screen update. Results are printed as JSON; with --budget-ms the script fails
+# when the median of a case goes over the budget.
+#
+#   python3 benchmarks/startup.py --runs 20 --budget-ms 150
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+# Runs in the measured interpreter, so it imports nothing tindit does not
+CHILD = """
+import os, sys
+sys.path[:0] = [{root!r}, {here!r}]
+from headless import HeadlessScreen, HeadlessTerminal
+
+class FirstFrame(HeadlessTerminal):
+    def doupdate(self):
+        sys.stdout.write("frame\\n")
+        sys.stdout.flush()
+        os._exit(0)
+
+# Compiled from source like a main script, whose bytecode is never cached
+path = os.path.join({root!r}, "tindit.py")
+with open(path, "rb") as f:
+    code = compile(f.read(), path, "exec")
+tindit = {{"__name__": "tindit", "__file__": path}}
+exec(code, tindit)
+tindit["main"](sys.argv[1:], FirstFrame(HeadlessScreen()))
+""".format(root=ROOT, here=HERE)
+
+def measure(argv, runs, env):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", CHILD, *argv],
+                                capture_output=True, text=True, env=env).stdout
+        if output.strip() != "frame":
+            raise SystemExit(f"startup with {argv} did not draw a frame")
+        samples.append(time.perf_counter() - start)
+    return {
+        "runs": runs,
+        "min_ms": min(samples) * 1000,
+        "median_ms": statistics.median(samples) * 1000,
+        "max_ms": max(samples) * 1000,
+    }
+
+def baseline(runs, env):
+    # The bare interpreter start, for reference
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], env=env)
+        samples.append(time.perf_counter() - start)
+    return {"runs": runs, "median_ms": statistics.median(samples) * 1000}
+
+def compile_time():
+    # The part of every start spent compiling tindit.py
+    with open(os.path.join(ROOT, "tindit.py")) as f:
+        source = f.read()
+    start = time.perf_counter()
+    compile(source, "tindit.py", "exec")
+    return (time.perf_counter() - start) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="tindit time-to-first-frame")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, help="fail if a case's median is above this")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tindit-startup-")
+    env = dict(os.environ, TINDIT_CONFIG_DIR=os.path.join(workdir, "config"))
+    try:
+        small = os.path.join(workdir, "small.py")
+        with open(small, "w") as f:
+            f.write("def main():\n    return 42\n" * 500)
+        large = os.path.join(workdir, "large.txt")
+        with open(large, "wb") as f:
+            f.write(b"a line of text in a large file\n" * (80 * 1024 * 1024 // 31))
+        # The first run writes the default config
+        measure([], 1, env)
+        results = {
+            "interpreter": baseline(args.runs, env),
+            "compile_script_ms": compile_time(),
+            "browser": measure([workdir], args.runs, env),
+            "small_file": measure([small], args.runs, env),
+            "small_file_line": measure([small + ":700"], args.runs, env),
+            "large_file": measure([large], args.runs, env),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.budget_ms is not None:
+        over = [name for name, result in results.items() if isinstance(result, dict) and "min_ms" in result and result["median_ms"] > args.budget_ms]
+        if over:
+            raise SystemExit(f"over the {args.budget_ms:g} ms budget: {', '.join(over)}")
+
+if __name__ == "__main__":
+    main()
@@ -3,45 +3,1858 @@ import os
 import curses
 import sys
 import json
-import platform
-import subprocess
+import re
+import signal
 import time
+import mmap
+import threading
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate, islice
+from collections import deque, OrderedDict
+# subprocess, tempfile and concurrent.futures are imported where they are
+# used, so starting the editor does not pay for them
+
+class _Fenwick:
+    # Binary indexed tree over chunk sizes: prefix sums and "which chunk holds
+    # item k" in O(log n).
+    def __init__(self, sizes):
+        self.rebuild(sizes)
+
+    def rebuild(self, sizes):
+        n = len(sizes)
+        tree = [0] * (n + 1)
+        for i, size in enumerate(sizes, 1):
+            tree[i] += size
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self.tree = tree
+        self.n = n
+
+    def add(self, i, delta):
+        i += 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+
+    def find(self, k):
+        pos, rest = 0, k
+        step = 1 << self.n.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= self.n and self.tree[nxt] <= rest:
+                pos = nxt
+                rest -= self.tree[nxt]
+            step >>= 1
+        return pos, rest
+
+class MappedFile:
+    # Memory-maps a file and records where every line starts on a background
+    # thread, so the first screen can be drawn before the whole file has been
+    # scanned. offsets[i] is the byte offset of line i; the indexer only ever
+    # appends to it. Bytes that are not UTF-8 decode to surrogates and the
+    # newline style of the first line is kept, so saving restores both.
+    BLOCK_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+        first = self.map[:self.map.find(b'\n') + 1] if self.size else b""
+        self.newline = '\r\n' if first.endswith(b'\r\n') else '\n'
+        self.offsets = array('Q', [0])
+        self.scanned = 0
+        self.done = False
+        self.cancelled = False
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.build_index, daemon=True)
+        self.thread.start()
+
+    def build_index(self):
+        block_size = 1024 * 1024  # Small first block so the first screen is ready quickly
+        while self.scanned < self.size and not self.cancelled:
+            block = self.map[self.scanned:self.scanned + block_size]
+            end = block.rfind(b'\n') + 1
+            if not end:
+                if self.scanned + len(block) >= self.size:
+                    break
+                block_size *= 2  # A single line longer than the block
+                continue
+            starts = accumulate((len(part) + 1 for part in block[:end - 1].split(b'\n')), initial=self.scanned)
+            next(starts)
+            self.offsets.extend(starts)
+            self.scanned += end
+            self.ready.set()
+            block_size = max(block_size, self.BLOCK_SIZE)
+        if not self.cancelled and self.offsets[-1] < self.size:
+            self.offsets.append(self.size)  # Last line has no trailing newline
+        self.done = True
+        self.ready.set()
+
+    def line_count(self):
+        return len(self.offsets) - 1
+
+    def progress(self):
+        return 100 * self.scanned // self.size if self.size else 100
+
+    def line(self, i):
+        line = self.map[self.offsets[i]:self.offsets[i + 1]].decode('utf-8', 'surrogateescape')
+        return line[:-2] + '\n' if line.endswith('\r\n') else line
+
+    def close(self):
+        self.cancelled = True
+        self.thread.join()
+        if self.size:
+            self.map.close()
+        self.file.close()
+
+class MappedLines:
+    # A run of lines that still live in a MappedFile. Lines are decoded on
+    # every access and only become real strings once the chunk is edited.
+    def __init__(self, source, start, stop):
+        self.source = source
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, _ = key.indices(len(self))
+            return [self.source.line(i) for i in range(self.start + start, self.start + stop)]
+        if key < 0:
+            key += len(self)
+        return self.source.line(self.start + key)
+
+    def slice(self, start, stop):
+        return MappedLines(self.source, self.start + start, self.start + stop)
+
+class TextBuffer:
+    # Lines (with their '\n') are stored in chunks of roughly CHUNK_LINES
+    # entries. A Fenwick tree over the chunk sizes gives O(log n) line lookup,
+    # and edits only touch one chunk; the index is rebuilt only when chunks
+    # are split or merged. Chunks are plain lists or MappedLines.
+    CHUNK_LINES = 512
+
+    def __init__(self, lines=None, source=None, newline='\n'):
+        self.source = source
+        self.newline = source.newline if source is not None else newline  # Written back in place of '\n'
+        self.loaded = 0
+        self.marks = []  # [y, x] positions that follow the text around them
+        self.listeners = []  # Called as listener(op, y, x, text) after every insert and delete
+        if source is not None:
+            source.ready.wait()
+            lines = None if source.line_count() else ['']
+        else:
+            lines = list(lines) if lines else ['']
+        self.chunks = [lines[i:i + self.CHUNK_LINES] for i in range(0, len(lines), self.CHUNK_LINES)] if lines else []
+        self.total = len(lines) if lines else 0
+        self.index = _Fenwick([len(chunk) for chunk in self.chunks])
+        self.poll()
+
+    def loading(self):
+        return self.source is not None and not (self.source.done and self.loaded == self.source.line_count())
+
+    def poll(self):
+        # Append the lines the indexer found since the last call. Lines read
+        # from the file always come after anything already in the buffer, so
+        # edits made while indexing stay in place.
+        if self.source is None:
+            return
+        count = self.source.line_count()
+        if count > self.loaded:
+            self.chunks += [MappedLines(self.source, i, min(i + self.CHUNK_LINES, count)) for i in range(self.loaded, count, self.CHUNK_LINES)]
+            self.loaded = count
+            self._reindex()
+
+    def finish_loading(self):
+        if self.source is not None:
+            self.source.thread.join()
+            self.poll()
+
+    def close(self):
+        if self.source is not None:
+            self.source.close()
+
+    def __len__(self):
+        return self.total
+
+    def _locate(self, y):
+        if not 0 <= y < self.total:
+            raise IndexError(f"line {y} out of range")
+        return self.index.find(y)
+
+    def _reindex(self):
+        self.chunks = [chunk for chunk in self.chunks if len(chunk)] or [['']]
+        self.total = sum(len(chunk) for chunk in self.chunks)
+        self.index.rebuild([len(chunk) for chunk in self.chunks])
+
+    def line(self, y):
+        ci, off = self._locate(y)
+        return self.chunks[ci][off]
+
+    def line_length(self, y):
+        line = self.line(y)
+        return len(line) - 1 if line.endswith('\n') else len(line)
+
+    def lines(self, start=0, stop=None):
+        stop = self.total if stop is None else min(stop, self.total)
+        if start >= stop:
+            return
+        ci, off = self._locate(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = self.chunks[ci]
+            for line in chunk[off:off + remaining]:
+                yield line
+            remaining -= len(chunk) - off
+            ci, off = ci + 1, 0
+
+    def iter_lines(self):
+        return self.lines(0, self.total)
+
+    def snapshot(self):
+        # Chunks that later edits cannot change, plus the byte offset in the
+        # mapped file where the lines that are not loaded yet start
+        chunks = [list(chunk) if isinstance(chunk, list) else chunk for chunk in self.chunks]
+        tail = None
+        if self.loading():
+            tail = self.source.offsets[self.loaded]
+        return chunks, tail
+
+    def replace_lines(self, y, count, new_lines):
+        ci, off = self._locate(y)
+        chunk = self.chunks[ci]
+        if off + count <= len(chunk):
+            # Common case: the edit stays inside one chunk.
+            if not isinstance(chunk, list):
+                self.chunks[ci] = chunk = chunk[:]
+            chunk[off:off + count] = new_lines
+            delta = len(new_lines) - count
+            if delta:
+                self.total += delta
+                self.index.add(ci, delta)
+                if len(chunk) > 2 * self.CHUNK_LINES or (not chunk and len(self.chunks) > 1):
+                    self.chunks[ci:ci + 1] = [chunk[i:i + self.CHUNK_LINES] for i in range(0, len(chunk), self.CHUNK_LINES)]
+                    self._reindex()
+            return
+        pieces = [self._slice(chunk, 0, off), list(new_lines)]
+        end = ci
+        remaining = count - (len(chunk) - off)
+        while remaining > 0 and end + 1 < len(self.chunks):
+            end += 1
+            if remaining < len(self.chunks[end]):
+                pieces.append(self._slice(self.chunks[end], remaining, len(self.chunks[end])))
+            remaining -= len(self.chunks[end])
+        self.chunks[ci:end + 1] = self._rechunk(pieces)
+        self._reindex()
+
+    def _slice(self, chunk, start, stop):
+        return chunk[start:stop] if isinstance(chunk, list) else chunk.slice(start, stop)
+
+    def _rechunk(self, pieces):
+        # Merge neighbouring list pieces and split them into CHUNK_LINES
+        # sized chunks; mapped pieces are kept as they are.
+        chunks, pending = [], []
+        for piece in pieces + [None]:
+            if isinstance(piece, list):
+                pending += piece
+                continue
+            chunks += [pending[i:i + self.CHUNK_LINES] for i in range(0, len(pending), self.CHUNK_LINES)]
+            pending = []
+            if piece is not None and len(piece):
+                chunks.append(piece)
+        return chunks
+
+    def insert(self, y, x, text):
+        line = self.line(y)
+        parts = text.split('\n')
+        if len(parts) == 1:
+            self.replace_lines(y, 1, [line[:x] + text + line[x:]])
+            end = y, x + len(text)
+        else:
+            new_lines = [line[:x] + parts[0] + '\n']
+            new_lines += [part + '\n' for part in parts[1:-1]]
+            new_lines.append(parts[-1] + line[x:])
+            self.replace_lines(y, 1, new_lines)
+            end = y + len(parts) - 1, len(parts[-1])
+        for mark in self.marks:
+            if mark[0] == y and mark[1] > x:
+                mark[0], mark[1] = end[0], end[1] + mark[1] - x
+            elif mark[0] > y:
+                mark[0] += end[0] - y
+        for listener in self.listeners:
+            listener('insert', y, x, text)
+        return end
+
+    def delete(self, y1, x1, y2, x2):
+        first = self.line(y1)
+        last = first if y2 == y1 else self.line(y2)
+        if y1 == y2:
+            removed = first[x1:x2]
+        else:
+            removed = first[x1:] + "".join(self.lines(y1 + 1, y2)) + last[:x2]
+        self.replace_lines(y1, y2 - y1 + 1, [first[:x1] + last[x2:]])
+        for mark in self.marks:
+            if (mark[0], mark[1]) <= (y1, x1):
+                continue
+            if (mark[0], mark[1]) <= (y2, x2):
+                mark[0], mark[1] = y1, x1
+            elif mark[0] == y2:
+                mark[0], mark[1] = y1, x1 + mark[1] - x2
+            else:
+                mark[0] -= y2 - y1
+        for listener in self.listeners:
+            listener('delete', y1, x1, removed)
+        return removed
+
+SNIPPET_FIELD = re.compile(r'\\\$|\$(\d+)|\$\{(\d+)(?::([^}]*))?\}')
+
+def parse_snippet(snippet):
+    # Turns "for ${1:item} in $2:\n    $0" into the text to insert plus the
+    # tab stops as (offset, number) pairs, with $0 visited last.
+    parts, fields, length = [], {}, 0
+    last = 0
+    for match in SNIPPET_FIELD.finditer(snippet):
+        parts.append(snippet[last:match.start()])
+        length += match.start() - last
+        last = match.end()
+        if match.group(0) == '\\$':
+            parts.append('$')
+            length += 1
+            continue
+        number = int(match.group(1) or match.group(2))
+        default = match.group(3) or ""
+        parts.append(default)
+        length += len(default)
+        fields.setdefault(number, length)
+    parts.append(snippet[last:])
+    order = sorted(fields, key=lambda number: (number == 0, number))
+    return "".join(parts), [(fields[number], number) for number in order]
+
+def text_end(y, x, text):
+    # Position just after text when it is inserted at (y, x)
+    newlines = text.count('\n')
+    if newlines:
+        return y + newlines, len(text) - text.rfind('\n') - 1
+    return y, x + len(text)
+
+class UndoJournal:
+    # Records every edit of a TextBuffer as (op, y, x, text), where text is
+    # what was inserted or deleted at (y, x). An entry is a list of ops that
+    # undo together; consecutive typing or backspacing on one line coalesces
+    # into a single entry. Once the entries take more than memory_limit
+    # bytes, the oldest ones are spilled to a temporary file and read back
+    # only if undo reaches them.
+    COALESCE_SECONDS = 1.0
+    OP_OVERHEAD = 64
+
+    def __init__(self, buffer, memory_limit):
+        self.buffer = buffer
+        self.memory_limit = memory_limit
+        self.entries = []
+        self.redo_entries = []
+        self.spilled = []  # (offset, length) of entries in spill_file, oldest first
+        self.spill_file = None
+        self.memory = 0
+        self.group_depth = 0
+        self.applying = False
+        self.last_time = 0
+        buffer.listeners.append(self.record)
+
+    def begin_group(self):
+        self.group_depth += 1
+        self.entries.append([])
+
+    def end_group(self):
+        self.group_depth -= 1
+        if not self.entries[-1]:
+            self.entries.pop()
+        self.seal()
+
+    def seal(self):
+        # The next edit starts a new entry
+        self.last_time = 0
+
+    def record(self, op, y, x, text):
+        if self.applying or not text:
+            return
+        self.redo_entries = []
+        now = time.monotonic()
+        new = [op, y, x, text]
+        if self.group_depth:
+            self.entries[-1].append(new)
+            self.memory += self.OP_OVERHEAD
+        elif self.entries and now - self.last_time < self.COALESCE_SECONDS and self.merge(self.entries[-1], new):
+            pass
+        else:
+            self.entries.append([new])
+            self.memory += self.OP_OVERHEAD
+        self.memory += len(text)
+        self.last_time = now
+        if self.memory > self.memory_limit and len(self.entries) > 1:
+            self.spill()
+
+    def merge(self, entry, new):
+        last = entry[-1]
+        if len(entry) != 1 or last[0] != new[0] or last[1] != new[1] or '\n' in last[3] or '\n' in new[3]:
+            return False
+        if new[0] == 'insert' and new[2] == last[2] + len(last[3]):
+            last[3] += new[3]
+            return True
+        if new[0] == 'delete' and new[2] + len(new[3]) == last[2]:  # Backspace
+            last[2], last[3] = new[2], new[3] + last[3]
+            return True
+        return False
+
+    def size(self, entry):
+        return sum(self.OP_OVERHEAD + len(op[3]) for op in entry)
+
+    def spill(self):
+        if self.spill_file is None:
+            import tempfile
+            self.spill_file = tempfile.TemporaryFile()
+        self.spill_file.seek(0, os.SEEK_END)
+        # Move the oldest half of the entries to disk, keeping the newest in memory
+        keep = max(1, len(self.entries) // 2)
+        for entry in self.entries[:-keep]:
+            data = json.dumps(entry).encode('utf-8')
+            self.spilled.append((self.spill_file.tell(), len(data)))
+            self.spill_file.write(data)
+            self.memory -= self.size(entry)
+        del self.entries[:-keep]
+
+    def pop_entry(self):
+        if self.entries:
+            entry = self.entries.pop()
+            self.memory -= self.size(entry)
+            return entry
+        if self.spilled:
+            offset, length = self.spilled.pop()
+            self.spill_file.seek(offset)
+            entry = json.loads(self.spill_file.read(length).decode('utf-8'))
+            self.spill_file.truncate(offset)
+            return entry
+        return None
+
+    def apply(self, op, y, x, text, inverse):
+        if (op == 'insert') != inverse:
+            return self.buffer.insert(y, x, text)
+        end_y, end_x = text_end(y, x, text)
+        self.buffer.delete(y, x, end_y, end_x)
+        return y, x
+
+    def undo(self):
+        # Returns where the cursor should go, or None if there is nothing to undo
+        entry = self.pop_entry()
+        if entry is None:
+            return None
+        self.applying = True
+        for op in reversed(entry):
+            cursor = self.apply(*op, inverse=True)
+        self.applying = False
+        self.redo_entries.append(entry)
+        self.seal()
+        return cursor
+
+    def redo(self):
+        if not self.redo_entries:
+            return None
+        entry = self.redo_entries.pop()
+        self.applying = True
+        for op in entry:
+            cursor = self.apply(*op, inverse=False)
+        self.applying = False
+        self.entries.append(entry)
+        self.memory += self.size(entry)
+        self.seal()
+        return cursor
+
+    def close(self):
+        self.buffer.listeners.remove(self.record)
+        if self.spill_file is not None:
+            self.spill_file.close()
+
+class FileWriter:
+    # Saves a TextBuffer snapshot on a background thread. The text goes to a
+    # temporary file next to the target, which is fsynced and then renamed
+    # over it, so a crash or a full disk never leaves a half-written file.
+    # Runs of unedited memory-mapped lines are copied as raw bytes, and
+    # edited lines get the file's newline style and raw bytes back.
+    RAW_BLOCK = 8 * 1024 * 1024
+    BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, path, buffer):
+        self.path = os.path.realpath(path)  # Replace the target of a symlink, not the link
+        self.source = buffer.source
+        self.newline = buffer.newline
+        self.chunks, self.tail = buffer.snapshot()
+        self.pieces = []
+        self.written = 0
+        self.error = None
+        self.thread = threading.Thread(target=self.write, daemon=True)
+        self.thread.start()
+
+    def running(self):
+        return self.thread.is_alive()
+
+    def wait(self):
+        self.thread.join()
+
+    def progress(self):
+        return 100 * self.written // len(self.pieces) if self.pieces else 0
+
+    def split(self):
+        # Lists of lines, and (start, stop) byte ranges of the mapped file
+        # for neighbouring mapped chunks, cut into RAW_BLOCK sized pieces
+        pieces, ranges = [], []
+        for chunk in self.chunks:
+            if isinstance(chunk, MappedLines):
+                start, stop = self.source.offsets[chunk.start], self.source.offsets[chunk.stop]
+                if ranges and ranges[-1][1] == start:
+                    ranges[-1][1] = stop
+                else:
+                    ranges.append([start, stop])
+                continue
+            pieces += [(start, stop) for start, stop in ranges]
+            ranges = []
+            pieces.append(chunk)
+        if self.tail is not None:
+            ranges.append([self.tail, self.source.size])
+        for start, stop in ranges:
+            pieces += [(offset, min(offset + self.RAW_BLOCK, stop)) for offset in range(start, stop, self.RAW_BLOCK)]
+        return pieces
+
+    def write(self):
+        import tempfile
+        directory, name = os.path.split(self.path)
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+            self.pieces = self.split()
+            with os.fdopen(fd, 'wb', buffering=self.BUFFER_SIZE) as f:
+                for piece in self.pieces:
+                    if isinstance(piece, tuple):
+                        f.write(self.source.map[piece[0]:piece[1]])
+                    else:
+                        text = "".join(piece)
+                        if self.newline != '\n':
+                            text = text.replace('\n', self.newline)
+                        f.write(text.encode('utf-8', 'surrogateescape'))
+                    self.written += 1
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(self.path):
+                os.chmod(temp_path, os.stat(self.path).st_mode & 0o7777)
+            else:
+                # mkstemp creates 0600; give new files the usual umask mode
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(temp_path, 0o666 & ~umask)
+            os.replace(temp_path, self.path)
+            if hasattr(os, 'O_DIRECTORY'):
+                # Make the rename itself survive a power loss
+                dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+        except Exception as error:
+            self.error = error
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+class SwapJournal:
+    # Appends every edit of a TextBuffer to a swap file as a JSON line, after
+    # a header naming the file and the size and mtime it had when the edits
+    # began, so unsaved work can be replayed onto that file after a crash.
+    # The swap file is created on the first edit and removed again when the
+    # buffer is closed normally.
+    def __init__(self, buffer, path, swap_path):
+        self.buffer = buffer
+        self.path = os.path.abspath(path)
+        self.swap_path = swap_path
+        self.file = None
+        self.since_save = None
+        buffer.listeners.append(self.record)
+
+    def header(self):
+        return {"path": self.path, **file_signature(self.path)}
+
+    def start(self, ops=()):
+        self.file = open(self.swap_path, 'w', encoding='utf-8')
+        self.file.write(json.dumps(self.header()) + "\n")
+        for op in ops:
+            self.file.write(json.dumps(op) + "\n")
+
+    def record(self, op, y, x, text):
+        if not text:
+            return
+        if self.file is None:
+            self.start()
+        self.file.write(json.dumps([op, y, x, text]) + "\n")
+        if self.since_save is not None:
+            self.since_save.append([op, y, x, text])
+
+    def flush(self):
+        # Called once per frame rather than after every op
+        if self.file is not None:
+            self.file.flush()
+
+    def begin_save(self):
+        self.since_save = []
+
+    def end_save(self, saved):
+        # The file on disk now holds everything up to the snapshot, so the
+        # swap file starts over from it with only the edits made since
+        ops, self.since_save = self.since_save, None
+        if not saved:
+            return
+        self.discard()
+        if ops:
+            self.start(ops)
+
+    def discard(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if os.path.exists(self.swap_path):
+            os.remove(self.swap_path)
+
+    def close(self):
+        self.buffer.listeners.remove(self.record)
+        self.discard()
+
+def file_signature(path):
+    # What a swap file header records about the file it applies to
+    try:
+        st = os.stat(path)
+    except OSError:
+        return {"size": None, "mtime": None}
+    return {"size": st.st_size, "mtime": st.st_mtime_ns}
+
+def config_dir():
+    # Where init.json, snippets.json and the swap files live;
+    # TINDIT_CONFIG_DIR overrides it
+    path = os.environ.get("TINDIT_CONFIG_DIR")
+    if path:
+        return path
+    if os.name == "nt":
+        return os.path.join(os.environ["APPDATA"], "tindit")
+    return os.path.expanduser("~/.config/tindit")
+
+def display_path(path):
+    # Relative to the working directory when the file is below it
+    relative = os.path.relpath(path)
+    return path if relative.startswith(os.pardir) else relative
+
+def read_lines(path):
+    # Reads a file the way MappedFile does: bytes that are not UTF-8 become
+    # surrogates, CRLF is stored as '\n' and the newline style of the first
+    # line is returned, so saving writes the same bytes back.
+    with open(path, 'r', encoding='utf-8', errors='surrogateescape', newline='\n') as f:
+        lines = f.readlines()
+    newline = '\r\n' if lines and lines[0].endswith('\r\n') else '\n'
+    return [line[:-2] + '\n' if line.endswith('\r\n') else line for line in lines], newline
+
+def read_swap(swap_path):
+    # Returns the header and the ops of a swap file. The last line may have
+    # been cut off by the crash, so reading stops at the first broken line.
+    with open(swap_path, encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        ops = []
+        for line in f:
+            try:
+                ops.append(json.loads(line))
+            except ValueError:
+                break
+    return header, ops
+
+class Document:
+    # A file open in a buffer. While another buffer is on screen, the
+    # editor's per-file fields are stashed here. version counts edits, so
+    # the buffer is dirty while it differs from the last saved version.
+    FIELDS = ('content', 'journal', 'highlighter', 'layout', 'words', 'swap', 'cursor_y', 'cursor_x', 'top_line', 'left_col', 'snippet_fields', 'snippet_bounds')
+    LINE_OVERHEAD = 64  # Rough size of a str object and its list slot
+
+    def __init__(self, filename, buffer):
+        self.path = os.path.abspath(filename)
+        self.signature = file_signature(filename)
+        self.version = 0
+        self.saved_version = 0
+        self.state = {}
+        buffer.listeners.append(self.changed)
+
+    def changed(self, op, y, x, text):
+        self.version += 1
+
+    def dirty(self):
+        return self.version != self.saved_version
+
+    def memory(self):
+        content = self.state['content']
+        if content.source is not None:
+            return len(content) * 8  # Only the line offsets live in memory
+        return (self.signature["size"] or 0) + len(content) * self.LINE_OVERHEAD
+
+    def stash(self, editor):
+        self.state = {field: getattr(editor, field) for field in self.FIELDS}
+
+    def restore(self, editor):
+        for field, value in self.state.items():
+            setattr(editor, field, value)
+        self.state = {}
+
+    def close(self):
+        for field in ('highlighter', 'layout', 'words', 'journal', 'swap', 'content'):
+            if self.state.get(field) is not None:
+                self.state[field].close()
+        self.state = {}
+
+class _TrieNode:
+    __slots__ = ("children", "best", "name")
 
-class TinyEditor:
     def __init__(self):
-        self.screen = curses.initscr()
-        curses.noecho()
-        curses.cbreak()
-        self.screen.keypad(True)
-        curses.start_color()
-        curses.use_default_colors()
-        for i in range(1, curses.COLORS):
-            curses.init_pair(i, i, -1)
+        self.children = {}
+        self.best = []
+        self.name = None
+
+class SnippetIndex:
+    # A trie over the snippet names answers "which names start with the typed
+    # word" and a trie over the reversed names answers "which names does the
+    # line end with". Every prefix node keeps its best `limit` completions, so
+    # a lookup only costs the length of the word, not the size of the library.
+    def __init__(self, names, limit=10):
+        self.limit = limit
+        self.prefixes = _TrieNode()
+        self.suffixes = _TrieNode()
+        # Shorter names rank first, so adding them in this order fills every
+        # node's best list with its top completions
+        for name in sorted(names, key=lambda name: (len(name), name)):
+            node = self.prefixes
+            for char in name:
+                node = node.children.setdefault(char, _TrieNode())
+                if len(node.best) < limit:
+                    node.best.append(name)
+            node = self.suffixes
+            for char in reversed(name):
+                node = node.children.setdefault(char, _TrieNode())
+            node.name = name
+
+    def suffix_matches(self, line):
+        # Names the line ends with, longest first
+        matches = []
+        node = self.suffixes
+        for i in range(len(line) - 1, -1, -1):
+            node = node.children.get(line[i])
+            if node is None:
+                break
+            if node.name is not None:
+                matches.append(node.name)
+        matches.reverse()
+        return matches
+
+    def prefix_matches(self, word):
+        node = self.prefixes
+        for char in word:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return node.best
+
+    def suggest(self, line):
+        # Prefix matches only for a line that holds nothing but the start of
+        # a name, so Enter keeps its meaning after ordinary words
+        typed = line.strip()
+        suggestions = self.suffix_matches(line)
+        if typed:
+            suggestions += [name for name in self.prefix_matches(typed) if name not in suggestions]
+        return suggestions[:self.limit]
+
+class WordIndex:
+    # Identifiers of a buffer for completion. words[y] holds the ones on
+    # line y (None until the line is read), counts how often each occurs
+    # and names keeps them sorted, so the words with a prefix are one
+    # bisect away. Edits re-read only the lines they touch; the rest of
+    # the buffer is read a slice per frame, and names is sorted once that
+    # is done. Words that go away stay in names until half of it is stale.
+    WORD = re.compile(r'[A-Za-z_]\w{2,}')
+    WINDOW = 100  # Lines above and below the cursor that rank by distance
+    CANDIDATES = 512  # Most words with the prefix looked at
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.words = [None] * len(buffer)
+        self.counts = {}
+        self.names = []
+        self.stale = 0
+        self.next = 0  # Lines before this one have all been read
+        self.sorted = False
+        buffer.listeners.append(self.changed)
+
+    def close(self):
+        self.buffer.listeners.remove(self.changed)
+
+    def changed(self, op, y, x, text):
+        lines = text.count('\n')
+        if op == 'insert':
+            self.words[y + 1:y + 1] = [None] * lines
+            if self.next > y:
+                self.next += lines
+        else:
+            for words in self.words[y + 1:y + lines + 1]:
+                self.forget(words)
+            del self.words[y + 1:y + lines + 1]
+            if self.next > y:
+                self.next = max(self.next - lines, y + 1)
+            lines = 0
+        for i, line in enumerate(self.buffer.lines(y, y + lines + 1), y):
+            self.read(i, line)
+
+    def read(self, y, line):
+        self.forget(self.words[y])
+        words = self.words[y] = tuple(self.WORD.findall(line))
+        for word in words:
+            count = self.counts.get(word, 0)
+            self.counts[word] = count + 1
+            if not count and self.sorted:
+                i = bisect_left(self.names, word)
+                if i < len(self.names) and self.names[i] == word:
+                    self.stale -= 1  # Came back before it was cleaned up
+                else:
+                    self.names.insert(i, word)
+        return words
+
+    def forget(self, words):
+        for word in words or ():
+            count = self.counts[word] - 1
+            if count:
+                self.counts[word] = count
+            else:
+                del self.counts[word]
+                if self.sorted:
+                    self.stale += 1
+
+    def done(self):
+        return self.next >= len(self.words)
+
+    def advance(self, budget):
+        deadline = time.perf_counter() + budget
+        y = self.next
+        for line in self.buffer.lines(y, len(self.words)):
+            if self.words[y] is None:
+                self.read(y, line)
+            y += 1
+            if not y & 255 and time.perf_counter() > deadline:
+                break
+        self.next = y
+        if self.done() and not self.sorted:
+            self.sort()
+
+    def sort(self):
+        self.names = sorted(self.counts)
+        self.stale = 0
+        self.sorted = True
+
+    def complete(self, prefix, y=None, limit=10):
+        # Words starting with prefix, ranked by how often they occur and,
+        # within WINDOW lines of y, by how close they are
+        scores = {}
+        if y is not None:
+            start = max(0, y - self.WINDOW)
+            for i, line in enumerate(self.buffer.lines(start, min(y + self.WINDOW + 1, len(self.words))), start):
+                words = self.words[i]
+                if words is None:
+                    words = self.read(i, line)
+                for word in words:
+                    if word.startswith(prefix):
+                        score = self.counts[word] / (1 + abs(i - y))
+                        if score > scores.get(word, 0):
+                            scores[word] = score
+        if self.sorted:
+            if self.stale > len(self.names) // 2:
+                self.sort()
+            i = bisect_left(self.names, prefix)
+            for word in self.names[i:i + self.CANDIDATES]:
+                if not word.startswith(prefix):
+                    break
+                if word not in scores and word in self.counts:
+                    scores[word] = self.counts[word] / (1 + self.WINDOW)
+        scores.pop(prefix, None)  # The word being typed
+        return heapq.nlargest(limit, scores, key=scores.get)
+
+class Job:
+    # A shell command started by `com`. Its output is read on a background
+    # thread into a bounded deque, so the editor keeps running meanwhile and
+    # only the last `max_lines` lines are kept.
+    MAX_LINE = 4096
+
+    def __init__(self, number, command, max_lines):
+        self.number = number
+        self.command = command
+        self.lines = deque(maxlen=max_lines)
+        self.received = 0
+        self.lock = threading.Lock()
+        self.returncode = None
+        self.reported = False
+        import subprocess
+        self.proc = subprocess.Popen(
+            command, shell=True, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True, errors='replace', start_new_session=os.name == 'posix')
+        self.thread = threading.Thread(target=self.read_output, daemon=True)
+        self.thread.start()
+
+    def read_output(self):
+        for line in self.proc.stdout:
+            with self.lock:
+                self.lines.append(line.rstrip('\n')[:self.MAX_LINE])
+                self.received += 1
+        self.proc.stdout.close()
+        self.returncode = self.proc.wait()
+
+    def running(self):
+        return self.returncode is None
+
+    def kill(self):
+        if self.proc.poll() is None:
+            try:
+                if os.name == 'posix':
+                    os.killpg(self.proc.pid, signal.SIGTERM)  # Also stop whatever the shell started
+                else:
+                    self.proc.kill()
+            except ProcessLookupError:
+                pass  # Reaped by the reader thread since the poll
+
+    def window(self, start, count):
+        with self.lock:
+            return list(islice(self.lines, start, start + count))
+
+    def find(self, pattern, start):
+        # Index of the next line containing pattern, searching from start and wrapping
+        with self.lock:
+            lines = list(self.lines)
+        for i in list(range(start, len(lines))) + list(range(0, min(start, len(lines)))):
+            if pattern in lines[i]:
+                return i
+        return None
+
+class DirectoryCache:
+    # Listings from os.scandir, sorted directories first. A listing is reused
+    # until the directory's mtime changes, so going back into a directory
+    # does not read it again. Entries are (name, is_dir); is_dir comes from
+    # the DirEntry type and normally needs no extra stat call.
+    def __init__(self, limit=32):
+        self.limit = limit
+        self.listings = OrderedDict()
+
+    def listing(self, path):
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.listings.get(path)
+        if cached is not None and cached[0] == mtime:
+            self.listings.move_to_end(path)
+            return cached[1]
+        entries = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                entries.append((entry.name, is_dir))
+        entries.sort(key=lambda entry: (not entry[1], entry[0].lower()))
+        self.listings[path] = (mtime, entries)
+        if len(self.listings) > self.limit:
+            self.listings.popitem(last=False)
+        return entries
+
+    def invalidate(self, path):
+        self.listings.pop(path, None)
+
+def compile_ignore_pattern(line):
+    # One .gitignore line -> (regex, negate, dir_only, anchored), or None
+    line = line.rstrip('\r\n').rstrip()
+    if not line or line.startswith('#'):
+        return None
+    negate = line.startswith('!')
+    if negate:
+        line = line[1:]
+    if line.startswith('\\'):
+        line = line[1:]
+    dir_only = line.endswith('/')
+    line = line.rstrip('/')
+    anchored = '/' in line
+    line = line.lstrip('/')
+    regex, i = [], 0
+    while i < len(line):
+        if line.startswith('**/', i):
+            regex.append('(?:.*/)?')
+            i += 3
+        elif line.startswith('**', i):
+            regex.append('.*')
+            i += 2
+        elif line[i] == '*':
+            regex.append('[^/]*')
+            i += 1
+        elif line[i] == '?':
+            regex.append('[^/]')
+            i += 1
+        elif line[i] == '[' and ']' in line[i + 2:]:
+            end = line.index(']', i + 2)
+            body = line[i + 1:end]
+            regex.append('[' + ('^' + body[1:] if body.startswith('!') else body).replace('\\', '\\\\') + ']')
+            i = end + 1
+        else:
+            regex.append(re.escape(line[i]))
+            i += 1
+    return re.compile(''.join(regex) + r'\Z'), negate, dir_only, anchored
+
+def is_ignored(rules, path, name, is_dir):
+    # rules are (base, regex, negate, dir_only, anchored); the last match wins
+    for base, regex, negate, dir_only, anchored in reversed(rules):
+        if dir_only and not is_dir:
+            continue
+        target = (path[len(base) + 1:] if base else path) if anchored else name
+        if regex.match(target):
+            return not negate
+    return False
+
+class FileIndex:
+    # Every file below root (as '/'-separated relative paths), skipping what
+    # .gitignore files exclude. Directories are scanned on a thread pool;
+    # afterwards the index is kept fresh by polling directory mtimes and
+    # rescanning only the directories that changed.
+    POLL_SECONDS = 5
+
+    def __init__(self, root, workers=8):
+        self.root = root
+        self.dirs = {}  # dir -> [mtime, .gitignore mtime, files, subdirs, rules]
+        self.paths = []
+        self.version = 0
+        self.building = True
+        self.active = True
+        self.closed = False
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        from concurrent.futures import ThreadPoolExecutor
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        threading.Thread(target=self.maintain, daemon=True).start()
+
+    def maintain(self):
+        try:
+            self.scan_tree("", [])
+            self.building = False
+            while not self.closed:
+                self.wake.wait(self.POLL_SECONDS)
+                self.wake.clear()
+                if self.active and not self.closed:
+                    self.poll()
+        except RuntimeError:
+            if not self.closed:
+                raise  # Otherwise close() shut the pool down under a scan
+
+    def close(self):
+        # Stop polling and drop the scans that have not started yet
+        self.closed = True
+        self.wake.set()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def full_path(self, rel):
+        return os.path.join(self.root, *rel.split('/')) if rel else self.root
+
+    def scan_dir(self, rel, rules):
+        path = self.full_path(rel)
+        mtime = os.stat(path).st_mtime_ns
+        ignore_mtime = None
+        try:
+            ignore_file = os.path.join(path, '.gitignore')
+            ignore_mtime = os.stat(ignore_file).st_mtime_ns
+            with open(ignore_file, 'r', errors='replace') as f:
+                patterns = [compile_ignore_pattern(line) for line in f]
+            rules = rules + [(rel,) + pattern for pattern in patterns if pattern]
+        except OSError:
+            pass
+        files, subdirs = [], []
+        with os.scandir(path) as it:
+            for entry in it:
+                child = rel + '/' + entry.name if rel else entry.name
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                if (is_dir and entry.name == '.git') or is_ignored(rules, child, entry.name, is_dir):
+                    continue
+                (subdirs if is_dir else files).append(child)
+        return rel, [mtime, ignore_mtime, files, subdirs, rules]
+
+    def scan_tree(self, rel, rules):
+        from concurrent.futures import wait, FIRST_COMPLETED
+        pending = {self.pool.submit(self.scan_dir, rel, rules)}
+        while pending and not self.closed:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    rel, record = future.result()
+                except OSError:
+                    continue
+                with self.lock:
+                    self.dirs[rel] = record
+                    if self.building:
+                        self.paths.extend(record[2])  # Results show up while the first scan runs
+                for subdir in record[3]:
+                    pending.add(self.pool.submit(self.scan_dir, subdir, record[4]))
+
+    def drop_tree(self, rel):
+        prefix = rel + '/'
+        with self.lock:
+            for key in [key for key in self.dirs if key == rel or key.startswith(prefix)]:
+                del self.dirs[key]
+
+    def poll(self):
+        changed = []
+        for rel, record in list(self.dirs.items()):
+            path = self.full_path(rel)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                mtime = None
+            try:
+                ignore_mtime = os.stat(os.path.join(path, '.gitignore')).st_mtime_ns
+            except OSError:
+                ignore_mtime = None
+            if mtime != record[0] or ignore_mtime != record[1]:
+                changed.append(rel)
+        if not changed:
+            return
+        for rel in changed:
+            old = self.dirs.get(rel)
+            parent = rel.rpartition('/')[0]
+            if old is None or (rel and parent not in self.dirs):
+                continue
+            parent_rules = self.dirs[parent][4] if rel else []
+            try:
+                rel, record = self.scan_dir(rel, parent_rules)
+            except OSError:
+                self.drop_tree(rel)
+                continue
+            if record[1] != old[1]:
+                # A changed .gitignore can affect everything below it
+                self.drop_tree(rel)
+                self.scan_tree(rel, parent_rules)
+                continue
+            with self.lock:
+                self.dirs[rel] = record
+            for subdir in set(old[3]) - set(record[3]):
+                self.drop_tree(subdir)
+            for subdir in set(record[3]) - set(old[3]):
+                self.scan_tree(subdir, record[4])
+        with self.lock:
+            self.paths = [path for record in self.dirs.values() for path in record[2]]
+            self.version += 1
+
+class FuzzySearch:
+    # Fuzzy-matches a query against a list of paths a batch at a time, so a
+    # keystroke never waits for the whole index: step() stops when its time
+    # budget runs out and the next frame continues where it left off.
+    BATCH = 2048
+    LIMIT = 100
+
+    def __init__(self, query, candidates, version=0):
+        self.query = query
+        self.pattern = re.compile('.*?'.join(re.escape(char) for char in query), re.IGNORECASE)
+        self.candidates = candidates
+        self.version = version
+        self.pos = 0
+        self.matches = []
+        self.best = []
+
+    def done(self):
+        return self.pos >= len(self.candidates)
+
+    def step(self, budget):
+        deadline = time.perf_counter() + budget
+        search = self.pattern.search
+        while self.pos < len(self.candidates) and time.perf_counter() < deadline:
+            batch = self.candidates[self.pos:self.pos + self.BATCH]
+            self.pos += len(batch)
+            for path in batch:
+                match = search(path)
+                if match is None:
+                    continue
+                self.matches.append(path)
+                # Prefer matches inside the file name, then tight matches
+                name_start = path.rfind('/') + 1
+                in_name = search(path, name_start)
+                if in_name is not None:
+                    match = in_name
+                score = -(match.end() - match.start()) - len(path) / 100
+                if match.start() >= name_start:
+                    score += 50 + (10 if match.start() == name_start else 0)
+                if len(self.best) < self.LIMIT:
+                    heapq.heappush(self.best, (score, path))
+                elif score > self.best[0][0]:
+                    heapq.heapreplace(self.best, (score, path))
+
+    def narrow(self, query, version):
+        # Typing another character can only remove matches, so a finished
+        # search over an index that did not change narrows its own matches
+        if self.done() and query.startswith(self.query) and version == self.version:
+            return FuzzySearch(query, self.matches, version)
+        return None
+
+    def results(self):
+        return [path for score, path in sorted(self.best, key=lambda item: (-item[0], item[1]))]
+
+SEARCH_PATTERNS = OrderedDict()
+
+def compile_search(text):
+    # Patterns typed in the command bar are compiled once and reused. Text
+    # that is not a valid regex (yet) is searched for literally.
+    pattern = SEARCH_PATTERNS.get(text)
+    if pattern is not None:
+        SEARCH_PATTERNS.move_to_end(text)
+        return pattern
+    try:
+        pattern = re.compile(text)
+    except re.error:
+        pattern = re.compile(re.escape(text))
+    SEARCH_PATTERNS[text] = pattern
+    if len(SEARCH_PATTERNS) > 64:
+        SEARCH_PATTERNS.popitem(last=False)
+    return pattern
+
+class BufferSearch:
+    # Finds the first match of pattern at or after (y, x) in a TextBuffer,
+    # wrapping around at the end. step() scans CHUNK_LINES lines at a time
+    # until its budget runs out, so searching a huge file never holds up a
+    # keystroke; the next frame continues where it stopped.
+    CHUNK_LINES = 1024
+
+    def __init__(self, buffer, pattern, y, x):
+        self.buffer = buffer
+        self.pattern = pattern
+        self.y = y
+        self.x = x
+        self.remaining = len(buffer) + 1  # The first line is visited again before x
+        self.match = None  # (y, x, length)
+        self.wrapped = False
+
+    def done(self):
+        return self.match is not None or self.remaining <= 0
+
+    def progress(self):
+        total = len(self.buffer) + 1
+        return 100 * (total - self.remaining) // total
+
+    def step(self, budget):
+        deadline = time.perf_counter() + budget
+        search = self.pattern.search
+        while not self.done() and time.perf_counter() < deadline:
+            if self.y >= len(self.buffer):
+                self.y = 0
+                self.wrapped = True
+            stop = min(self.y + self.CHUNK_LINES, self.y + self.remaining, len(self.buffer))
+            for line in self.buffer.lines(self.y, stop):
+                match = search(line[:-1] if line.endswith('\n') else line, self.x)
+                if match is not None:
+                    self.match = (self.y, match.start(), match.end() - match.start())
+                    return
+                self.y += 1
+                self.x = 0
+                self.remaining -= 1
+
+class Lexer:
+    # Splits one line into (start, end, kind) spans given the state the
+    # previous line ended in. The state is None outside of multi-line
+    # strings and the closing delimiter inside of one.
+    TOKEN = None
+    KEYWORDS = frozenset()
+    BUILTINS = frozenset()
+
+    def __init__(self):
+        self.closers = {}
+
+    def close(self, line, start, delimiter):
+        # End of the string closed by delimiter, or -1 if it runs past line
+        closer = self.closers.get(delimiter)
+        if closer is None:
+            closer = self.closers[delimiter] = re.compile(r'(?:\\.|[^\\])*?' + re.escape(delimiter))
+        match = closer.match(line, start)
+        return match.end() if match else -1
+
+    def tokenize(self, line, state):
+        spans = []
+        pos = 0
+        if state is not None:
+            pos = self.close(line, 0, state)
+            if pos < 0:
+                return [(0, len(line), 'string')], state
+            spans.append((0, pos, 'string'))
+        search = self.TOKEN.search
+        while True:
+            match = search(line, pos)
+            if match is None:
+                return spans, None
+            kind = match.lastgroup
+            start, pos = match.span()
+            if kind == 'open':
+                delimiter = match.group().lstrip('rRbBuUfF')
+                pos = self.close(line, pos, delimiter)
+                if pos < 0:
+                    spans.append((start, len(line), 'string'))
+                    return spans, delimiter
+                kind = 'string'
+            elif kind == 'name':
+                word = match.group()
+                if word in self.KEYWORDS:
+                    kind = 'keyword'
+                elif word in self.BUILTINS:
+                    kind = 'builtin'
+                else:
+                    continue
+            spans.append((start, pos, kind))
+
+class PythonLexer(Lexer):
+    TOKEN = re.compile(r'''
+        (?P<comment>\#.*)
+      | (?P<open>[rRbBuUfF]{0,2}(?:\'\'\'|"""))
+      | (?P<string>[rRbBuUfF]{0,2}(?:'(?:\\.|[^'\\])*'?|"(?:\\.|[^"\\])*"?))
+      | (?P<number>\b(?:0[xXoObB][\da-fA-F_]+|\d[\d_]*\.?[\d_]*(?:[eE][+-]?\d+)?[jJ]?))
+      | (?P<decorator>@[\w.]+)
+      | (?P<name>[A-Za-z_]\w*)
+    ''', re.VERBOSE)
+    KEYWORDS = frozenset('''False None True and as assert async await break class continue def del
+        elif else except finally for from global if import in is lambda match case nonlocal not or
+        pass raise return try while with yield'''.split())
+    BUILTINS = frozenset('''abs all any bool bytes callable chr dict dir enumerate filter float
+        format getattr hasattr hash id input int isinstance issubclass iter len list map max min
+        next object open ord print property range repr reversed round self set setattr slice
+        sorted staticmethod str sum super tuple type zip'''.split())
+
+class JSONLexer(Lexer):
+    TOKEN = re.compile(r'''
+        (?P<key>"(?:\\.|[^"\\])*"(?=\s*:))
+      | (?P<string>"(?:\\.|[^"\\])*"?)
+      | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+      | (?P<name>[A-Za-z_]\w*)
+    ''', re.VERBOSE)
+    KEYWORDS = frozenset(('true', 'false', 'null'))
+
+class ShellLexer(Lexer):
+    TOKEN = re.compile(r'''
+        (?P<comment>(?<![^\s;|&(])\#.*)
+      | (?P<string>'[^']*'|"(?:\\.|[^"\\])*")
+      | (?P<open>['"])
+      | (?P<variable>\$(?:\{[^}]*\}|\w+|[@#?$!*-]))
+      | (?P<number>\b\d+\b)
+      | (?P<name>[A-Za-z_][\w-]*)
+    ''', re.VERBOSE)
+    KEYWORDS = frozenset('''if then else elif fi for while until do done case esac in function
+        select return break continue local export readonly declare unset shift exit'''.split())
+    BUILTINS = frozenset('''echo printf read cd pwd test source eval exec set trap wait kill
+        true false'''.split())
+
+LEXERS = {
+    '.py': PythonLexer, '.pyw': PythonLexer,
+    '.json': JSONLexer,
+    '.sh': ShellLexer, '.bash': ShellLexer, '.zsh': ShellLexer,
+}
+TOKEN_COLORS = {
+    'keyword': curses.COLOR_MAGENTA, 'builtin': curses.COLOR_CYAN, 'string': curses.COLOR_GREEN,
+    'comment': curses.COLOR_BLUE, 'number': curses.COLOR_YELLOW, 'decorator': curses.COLOR_YELLOW,
+    'key': curses.COLOR_CYAN, 'variable': curses.COLOR_YELLOW,
+}
+UNKNOWN = object()
+
+class Highlighter:
+    # Keeps the lexer state at the end of every line of a TextBuffer. An
+    # edit only marks states from the edited line on as stale; advance()
+    # re-lexes from there and stops as soon as a line ends in the same
+    # state it had before, since everything after it is unchanged. The
+    # work is time-budgeted, and only the visible rows are turned into spans.
+    SPAN_CACHE = 1024
+
+    def __init__(self, buffer, lexer):
+        self.buffer = buffer
+        self.lexer = lexer
+        self.states = [UNKNOWN] * len(buffer)
+        self.valid = 0  # states[:valid] are correct
+        self.known = 0  # states[:known] were computed at some point
+        self.settle = 0  # first line that may end the re-lexing
+        self.spans = {}
+        buffer.listeners.append(self.changed)
+
+    def close(self):
+        self.buffer.listeners.remove(self.changed)
+
+    def changed(self, op, y, x, text):
+        # The old end state of line y now belongs to the last line of the
+        # edited range, so the splice happens in front of it
+        lines = text.count('\n')
+        if op == 'insert':
+            self.states[y:y] = [UNKNOWN] * lines
+        else:
+            del self.states[y:y + lines]
+            lines = -lines
+        if self.known > y:
+            self.known = max(self.known + lines, y + 1)
+        if self.settle > y:
+            self.settle = max(self.settle + lines, y)
+        self.settle = max(self.settle, y + max(lines, 0))
+        self.valid = min(self.valid, y)
+
+    def done(self, target):
+        return self.valid >= min(target, len(self.states))
+
+    def advance(self, target, budget):
+        deadline = time.perf_counter() + budget
+        target = min(target, len(self.states))
+        tokenize = self.lexer.tokenize
+        while self.valid < target:
+            y = self.valid
+            state = self.states[y - 1] if y else None
+            for line in self.buffer.lines(y, target):
+                spans, state = tokenize(line.rstrip('\r\n'), state)
+                if self.settle <= y < self.known and self.states[y] == state:
+                    self.valid = self.known
+                    break
+                self.states[y] = state
+                y += 1
+                self.valid = y
+                if y > self.known:
+                    self.known = y
+                if not y & 63 and time.perf_counter() > deadline:
+                    return False
+        return True
+
+    def line_spans(self, y, line):
+        # Lines above an unfinished stretch start from their last known state
+        state = self.states[y - 1] if y else None
+        if state is UNKNOWN:
+            state = None
+        key = (line, state)
+        spans = self.spans.get(key)
+        if spans is None:
+            if len(self.spans) > self.SPAN_CACHE:
+                self.spans.clear()
+            spans = self.spans[key] = self.lexer.tokenize(line.rstrip('\r\n'), state)[0]
+        return spans
+
+# Characters that may not be one column wide: tabs, control characters
+# and anything outside ASCII. Lines without them are laid out one to one.
+SPECIAL_CHARS = re.compile('[\x00-\x1f\x7f-\U0010ffff]')
+PRINTABLE_ASCII = bytes(range(32, 127))
+
+def special_chars(line, length):
+    if not line.isascii():
+        return [match.start() for match in SPECIAL_CHARS.finditer(line, 0, length)]
+    # Scanning with a regex takes ~10 ns a character; for ASCII lines the
+    # few special bytes are found with translate and find instead
+    data = line.encode('ascii')
+    found = []
+    for byte in set(data.translate(None, PRINTABLE_ASCII)):
+        x = data.find(byte, 0, length)
+        while x >= 0:
+            found.append(x)
+            x = data.find(byte, x + 1, length)
+    found.sort()
+    return found
+
+class Layout:
+    # Display columns of buffer lines. Only the characters that are not one
+    # column wide are recorded: xs holds their indexes, cols their start
+    # columns and ends the column after them, so column lookups are a
+    # bisect. Lines are laid out when first drawn and dropped on edits.
+    CACHE = 4096
+
+    def __init__(self, buffer, tab_width):
+        self.buffer = buffer
+        self.tab_width = max(tab_width, 1)
+        self.lines = {}
+        buffer.listeners.append(self.changed)
+
+    def close(self):
+        self.buffer.listeners.remove(self.changed)
+
+    def changed(self, op, y, x, text):
+        if '\n' in text:
+            # Lines below moved, so their layouts are keyed wrong now
+            self.lines = {key: value for key, value in self.lines.items() if key < y}
+        else:
+            self.lines.pop(y, None)
+
+    def line(self, y, line):
+        layout = self.lines.get(y)
+        if layout is None:
+            if len(self.lines) > self.CACHE:
+                self.lines.clear()
+            layout = self.lines[y] = self.lay_out(line)
+        return layout
+
+    def lay_out(self, line):
+        length = len(line)
+        if line.endswith('\n'):
+            length -= 2 if line.endswith('\r\n') else 1
+        xs, cols, ends = [], [], []
+        extra = 0  # Columns gained (or lost) before the current character
+        for x in special_chars(line, length):
+            char = line[x]
+            if char == '\t':
+                width = self.tab_width - (x + extra) % self.tab_width
+            elif char < ' ' or char == '\x7f':
+                width = 2  # Drawn as ^X
+            elif '\udc80' <= char <= '\udcff':
+                width = 1  # A byte that is not UTF-8, drawn as U+FFFD
+            else:
+                width = char_width(char)
+                if width == 1:
+                    continue
+            xs.append(x)
+            cols.append(x + extra)
+            extra += width - 1
+            ends.append(x + extra + 1)
+        return line, length, xs, cols, ends
+
+    def column(self, layout, x):
+        # Display column where character x starts
+        line, length, xs, cols, ends = layout
+        i = bisect_left(xs, x) - 1
+        return x if i < 0 else ends[i] + x - xs[i] - 1
+
+    def index(self, layout, col):
+        # First character that starts at or after col
+        line, length, xs, cols, ends = layout
+        i = bisect_right(cols, col) - 1
+        if i < 0:
+            x = col
+        elif col == cols[i]:
+            x = xs[i]
+        elif col < ends[i]:
+            x = xs[i] + 1  # col falls inside a wide character or a tab
+        else:
+            x = xs[i] + 1 + col - ends[i]
+        return min(x, length)
+
+    def visible(self, layout, left, width):
+        # Range of the characters that fit in columns left..left+width
+        if not layout[2]:
+            return min(left, layout[1]), min(left + width, layout[1])
+        first = self.index(layout, left)
+        last = self.index(layout, left + width)
+        if last > first and self.column(layout, last) > left + width:
+            last -= 1  # A wide character cut by the right edge
+        return first, last
+
+    def segment(self, layout, first, last, left):
+        # Characters first..last as they are drawn: (column - left, text)
+        line, length, xs, cols, ends = layout
+        if not xs:
+            return first - left, line[first:last]
+        col = self.column(layout, first)
+        i = bisect_left(xs, first)
+        j = bisect_left(xs, last)
+        if i == j:
+            return col - left, line[first:last]
+        pieces = []
+        x = first
+        for k in range(i, j):
+            pieces.append(line[x:xs[k]])
+            char = line[xs[k]]
+            if char == '\t':
+                pieces.append(' ' * (ends[k] - cols[k]))
+            elif char < ' ' or char == '\x7f':
+                pieces.append('^' + chr(ord(char) ^ 64))
+            elif '\udc80' <= char <= '\udcff':
+                pieces.append('\ufffd')
+            else:
+                pieces.append(char)
+            x = xs[k] + 1
+        pieces.append(line[x:last])
+        return col - left, ''.join(pieces)
+
+def char_width(char):
+    import unicodedata
+    if unicodedata.east_asian_width(char) in 'WF':
+        return 2
+    if unicodedata.category(char) in ('Mn', 'Me', 'Cf'):
+        return 0  # Combining marks and zero-width characters
+    return 1
+
+class Stats:
+    # Rolling timings of the phases of a frame: the last WINDOW samples of
+    # each phase are kept, so the percentiles follow what the editor is
+    # doing now. Frames slower than slow_ms are appended to trace_path.
+    WINDOW = 2048
+    PHASES = ('dispatch', 'edit', 'snippet', 'render', 'refresh')
+
+    def __init__(self, trace_path="", slow_ms=50):
+        self.samples = {phase: deque(maxlen=self.WINDOW) for phase in self.PHASES}
+        self.frames = 0
+        self.slow_frames = 0
+        self.trace_path = trace_path
+        self.slow = slow_ms / 1000
+        self.trace = None
+
+    def add(self, phase, seconds):
+        self.samples[phase].append(seconds)
+
+    def frame(self, keys, dispatch, render, refresh, lines, filename):
+        # One frame is the handling of a batch of keys plus the redraw after it
+        self.frames += 1
+        self.add('dispatch', dispatch)
+        self.add('render', render - refresh)
+        self.add('refresh', refresh)
+        if dispatch + render < self.slow:
+            return
+        self.slow_frames += 1
+        if not self.trace_path:
+            return
+        if self.trace is None:
+            self.trace = open(os.path.expanduser(self.trace_path), 'a', buffering=1)
+        self.trace.write(json.dumps({
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "keys": [key if isinstance(key, int) else f"paste:{len(key)}" for key in keys[:20]],
+            "dispatch_ms": round(dispatch * 1000, 3),
+            "render_ms": round((render - refresh) * 1000, 3),
+            "refresh_ms": round(refresh * 1000, 3),
+            "file": filename,
+            "lines": lines,
+        }) + "\n")
+
+    def percentiles(self, phase):
+        samples = sorted(self.samples[phase])
+        if not samples:
+            return None
+        return [samples[min(len(samples) - 1, int(q * len(samples)))] * 1000 for q in (0.50, 0.95, 0.99)]
+
+    def report(self):
+        lines = [f"{'phase':<10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'samples':>10}"]
+        for phase in self.PHASES:
+            values = self.percentiles(phase)
+            if values is None:
+                lines.append(f"{phase:<10}{'-':>10}{'-':>10}{'-':>10}{0:>10}")
+            else:
+                lines.append(f"{phase:<10}" + "".join(f"{value:>10.3f}" for value in values) + f"{len(self.samples[phase]):>10}")
+        lines.append(f"{self.frames} frames, {self.slow_frames} slower than {self.slow * 1000:g} ms")
+        return lines
+
+    def close(self):
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+class Animation:
+    # Precomputed frames played by the run loop's frame clock. A frame is
+    # (delay, clear, cells): delay seconds after the previous frame the
+    # screen is erased if clear and the (y, x, text, attr) runs in cells
+    # are written, so a frame only touches the cells that changed.
+    def __init__(self, frames):
+        self.frames = frames
+        self.index = 0
+        self.due = time.perf_counter() + frames[0][0]
+
+    def wait_ms(self):
+        return max(0, int((self.due - time.perf_counter()) * 1000) + 1)
+
+    def play(self, screen, term):
+        # Draw every frame that is due; False once the last one is over
+        height, width = screen.getmaxyx()
+        drawn = False
+        while self.index < len(self.frames) and time.perf_counter() >= self.due:
+            delay, clear, cells = self.frames[self.index]
+            if clear:
+                screen.erase()
+            for y, x, text, attr in cells:
+                if y < height and x < width - 1:
+                    screen.addstr(y, x, text[:width - 1 - x], attr)
+            drawn = True
+            self.index += 1
+            if self.index < len(self.frames):
+                self.due += self.frames[self.index][0]
+        if drawn:
+            screen.noutrefresh()
+            term.doupdate()
+        return self.index < len(self.frames)
+
+def explosion_frames(rows, height, width, center_y, center_x):
+    # A circle of reversed cells grows from the cursor by two cells every
+    # 0.1 s over the rows of text. A row's part of the circle is a single
+    # span found with isqrt, so each frame only writes the ring that is
+    # new since the one before. Then the text falls to the bottom.
+    import math
+    frames = []
+    spans = [None] * len(rows)  # Columns of each row already covered
+    radius = 1
+    while radius < max(height, width):
+        cells = []
+        for y in range(len(rows)):
+            rest = radius * radius - (y - center_y) ** 2
+            if rest < 0:
+                continue
+            half = math.isqrt(rest)
+            left, right = max(center_x - half, 0), min(center_x + half, width - 2)
+            if left > right:
+                continue
+            if spans[y] is None:
+                cells.append((y, left, " " * (right - left + 1), curses.A_REVERSE))
+            else:
+                if left < spans[y][0]:
+                    cells.append((y, left, " " * (spans[y][0] - left), curses.A_REVERSE))
+                if right > spans[y][1]:
+                    cells.append((y, spans[y][1] + 1, " " * (right - spans[y][1]), curses.A_REVERSE))
+            spans[y] = (left, right)
+        frames.append((0.1 if frames else 0, False, cells))
+        radius += 2
+    fallen = [(height - 5 + i, 0, row, 0) for i, row in enumerate(rows[:4])]
+    fallen.append((height - 1, 0, "Characters have fallen to the bottom!", 0))
+    frames.append((2, True, fallen))
+    frames.append((5, False, []))  # Keep the last frame up for a while
+    return frames
+
+class Renderer:
+    # Keeps a copy of what every screen row shows and only repaints the rows
+    # whose segments changed. A row is a tuple of (x, text, attr) segments
+    # drawn in order, so later segments overlay earlier ones.
+    def __init__(self, screen, term=curses):
+        self.screen = screen
+        self.term = term
+        self.screen.idlok(True)
+        self.refresh_time = 0
+        self.invalidate()
+
+    def invalidate(self):
+        self.size = None
+        self.rows = []
+        self.view = None
+        self.top = 0
+
+    def begin(self):
+        self.refresh_time = 0
+        size = self.screen.getmaxyx()
+        if size != self.size:
+            self.size = size
+            self.rows = [None] * size[0]
+            self.view = None
+            self.screen.erase()
+        return size
+
+    def scroll_to(self, view, top, region):
+        # Shift the rows already on screen with insdelln when the same view
+        # scrolls by less than a screenful, so only the exposed rows repaint.
+        delta = top - self.top
+        if view == self.view and 0 < abs(delta) < region:
+            self.screen.move(0, 0)
+            self.screen.insdelln(-delta)
+            if delta > 0:
+                self.rows = self.rows[delta:] + [None] * delta
+            else:
+                self.rows = [None] * -delta + self.rows[:delta]
+        self.view = view
+        self.top = top
+
+    def draw(self, y, segments):
+        segments = tuple(segments)
+        if self.rows[y] == segments:
+            return
+        self.rows[y] = segments
+        width = self.size[1]
+        self.screen.move(y, 0)
+        self.screen.clrtoeol()
+        for x, text, attr in segments:
+            if x < width - 1 and text:
+                self.screen.addstr(y, x, text[:width - 1 - x], attr)
+
+    def finish(self, cursor_y=None, cursor_x=None):
+        if cursor_y is not None:
+            self.screen.move(cursor_y, cursor_x)
+        start = time.perf_counter()
+        self.screen.noutrefresh()
+        self.term.doupdate()
+        self.refresh_time = time.perf_counter() - start
+
+REPLACE_GAP = 32  # Unchanged lines one replace edit may span
+WORD_TAIL = re.compile(r'[A-Za-z_]\w*$')  # The identifier that ends at the cursor
+RECENT_BUFFERS = 4  # Other buffers whose words are offered for completion
+PASTE_START = [27, ord('['), ord('2'), ord('0'), ord('0'), ord('~')]
+PASTE_END = [27, ord('['), ord('2'), ord('0'), ord('1'), ord('~')]
+MOVE_KEYS = {
+    curses.KEY_UP: (-1, 0),
+    curses.KEY_DOWN: (1, 0),
+    curses.KEY_LEFT: (0, -1),
+    curses.KEY_RIGHT: (0, 1),
+    curses.KEY_PPAGE: (-1, 0),
+    curses.KEY_NPAGE: (1, 0),
+}
+
+class TinyEditor:
+    def __init__(self, term=curses):
+        # term provides the curses module functions, so a headless stand-in
+        # can drive the editor without a real terminal
+        self.term = term
+        self.token_attrs = None  # Colours are set up when the first file is highlighted
         self.current_file = None
-        self.content = []
+        self.content = TextBuffer()
+        self.journal = None
+        self.highlighter = None
+        self.layout = None
+        self.words = None  # WordIndex for completion
+        self.writer = None
+        self.swap = None
+        self.search = None  # BufferSearch still looking for the next match
+        self.animation = None  # Animation that has the screen until it ends or a key is pressed
+        self.search_pattern = None  # Matches of this are highlighted
+        self.search_origin = None  # Cursor and scroll position while a / search is typed
+        self.document = None
+        self.buffers = OrderedDict()  # Path -> Document of the cached buffers, least recently used first
         self.cursor_y, self.cursor_x = 0, 0
         self.top_line = 0
+        self.left_col = 0  # First display column shown, for long lines
         self.command_mode = False
         self.command_buffer = []
         self.config = self.load_config()
-        self.files = []
+        self.stats = Stats(self.config["trace_file"], self.config["slow_frame_ms"])
+        self.files = None  # Listed when the file browser is first shown
         self.selected_file = 0
-        self.snippets = self.load_snippets()
+        self.browser_top = 0
+        self.dir_cache = DirectoryCache()
+        self.snippets = None  # Loaded on the first snippet lookup
+        self.snippet_index = None
         self.snippet_mode = False
         self.snippet_selection = 0
         self.snippet_suggestions = []
+        self.word_popup = False  # CTRL+N asked for word completions
+        self.snippet_fields = []
+        self.snippet_bounds = None  # Start and end marks of the snippet the fields belong to
+        self.jobs = []
+        self.output_pane = False
+        self.output_job = 0
+        self.output_top = None  # None follows the end of the output
+        self.output_search = None
+        self.output_pattern = ""
+        self.status_message = ""
+        self.file_index = None
+        self.finder_active = False
+        self.finder_query = []
+        self.finder_search = None
+        self.finder_selection = 0
+        # The terminal is taken over last, so a broken init.json leaves it
+        # as it was
+        self.screen = term.initscr()
+        term.noecho()
+        term.raw()  # Deliver CTRL+C and friends as keys
+        self.screen.keypad(True)
+        self.renderer = Renderer(self.screen, term)
+        self.gutter_cache = {}
 
     def load_config(self):
-        if platform.system() == "Windows":
-            config_dir = os.path.join(os.environ["APPDATA"], "tindit")
-        else:
-            config_dir = os.path.expanduser("~/.config/tindit")
-        
-        config_file = os.path.join(config_dir, "init.json")
-        default_config = {"number": False, "relative_number": False, "tab_is": "SPC", "tab_space_len": 4, "snippets_enabled": True}
+        directory = config_dir()
+        config_file = os.path.join(directory, "init.json")
+        default_config = {"number": False, "relative_number": False, "tab_is": "SPC", "tab_space_len": 4, "snippets_enabled": True, "large_file_mb": 64, "snippet_suggestions_max": 10, "job_output_lines": 10000, "undo_memory_kb": 4096, "syntax_highlighting": True, "trace_file": "", "slow_frame_ms": 50, "swap_files": True, "buffer_cache_mb": 256, "word_completion": True}
 
-        if not os.path.exists(config_dir):
-            os.makedirs(config_dir)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
 
         if not os.path.exists(config_file):
             with open(config_file, 'w') as f:
@@ -49,257 +1862,776 @@ class TinyEditor:
             return default_config
 
         with open(config_file, 'r') as f:
-            config = json.load(f)
+            config = dict(default_config)  # Options added in newer versions keep their defaults
+            config.update(json.load(f))
             return config
 
     def load_snippets(self):
-        if platform.system() == "Windows":
-            config_dir = os.path.join(os.environ["APPDATA"], "tindit")
-        else:
-            config_dir = os.path.expanduser("~/.config/tindit")
-        
-        snippets_file = os.path.join(config_dir, "snippets.json")
+        snippets_file = os.path.join(config_dir(), "snippets.json")
         default_snippets = {"hello": "print(\"Hello, world!\")\n"}
 
         if not os.path.exists(snippets_file):
             with open(snippets_file, 'w') as f:
                 json.dump(default_snippets, f)
-            return default_snippets
+            snippets = default_snippets
+        else:
+            with open(snippets_file, 'r') as f:
+                snippets = json.load(f)
 
-        with open(snippets_file, 'r') as f:
-            snippets = json.load(f)
-            return snippets
+        self.snippet_index = SnippetIndex(snippets, self.config["snippet_suggestions_max"])
+        return snippets
 
     def run(self):
-        self.show_file_browser()
+        # The terminal is restored however the loop ends
+        self.set_bracketed_paste(True)
+        try:
+            self.loop()
+        finally:
+            self.cleanup()
+
+    def loop(self):
+        keys = []
+        dispatch = 0
         while True:
-            if self.current_file:
-                self.display_file()
+            self.poll_jobs()
+            self.poll_save()
+            start = time.perf_counter()
+            if self.finder_active:
+                self.update_finder()
+                self.display_finder()
+            elif self.output_pane:
+                self.display_output()
+            elif self.current_file:
+                self.step_search()
+                self.step_words()
+                self.scroll_to_cursor()
+                if self.animation is None or self.animation.index == 0:
+                    self.display_file()
+                if self.animation is not None:
+                    self.step_animation()
             else:
                 self.display_file_browser()
-            
+            if keys:
+                self.stats.frame(keys, dispatch, time.perf_counter() - start, self.renderer.refresh_time, len(self.content), self.current_file)
+
+            keys = self.read_keys()
+            self.content.poll()
+            if keys and self.animation is not None:
+                # Any key skips the animation
+                keys = []
+                self.animation = None
+                self.renderer.invalidate()
+            if keys:
+                self.status_message = ""
+            start = time.perf_counter()
+            if self.handle_keys(keys) is False:
+                break
+            dispatch = time.perf_counter() - start
+            if self.snippet_bounds is not None:
+                self.check_snippet_fields()
+            if self.swap is not None:
+                self.swap.flush()
+
+            # Ensure the cursor is visible after any key press
+            self.term.curs_set(1)  # Show the cursor
+
+    def set_bracketed_paste(self, enabled):
+        # Ask the terminal to wrap pastes in ESC[200~ ... ESC[201~
+        if sys.stdout.isatty():
+            sys.stdout.write("\033[?2004h" if enabled else "\033[?2004l")
+            sys.stdout.flush()
+
+    def read_keys(self):
+        # Block for the first key, then drain everything that is already
+        # pending so a burst of input is handled before the next frame.
+        # Wake up periodically while a large file is still being indexed
+        # or a job is running.
+        busy = self.content.loading() or self.writer is not None or any(job.running() for job in self.jobs)
+        # Background work on the file only runs while the file is on screen
+        editing = self.current_file and not self.output_pane and not self.finder_active
+        if self.animation is not None:
+            self.screen.timeout(self.animation.wait_ms())
+        elif self.finder_active and (self.file_index.building or not self.finder_search.done()):
+            self.screen.timeout(0 if not self.finder_search.done() else 100)
+        elif editing and self.highlighter and not self.highlighter.done(self.highlight_target()):
+            self.screen.timeout(0)  # Keep highlighting up to the visible rows between keys
+        elif editing and self.search is not None:
+            self.screen.timeout(0)
+        elif editing and not all(words.done() for words in self.word_indexes()):
+            self.screen.timeout(0)  # Finish reading the words for completion
+        else:
+            self.screen.timeout(100 if busy else -1)
+        ch = self.screen.getch()
+        if ch == -1:
+            return []
+        keys = [ch]
+        self.screen.nodelay(True)
+        while ch != -1:
             ch = self.screen.getch()
-            if ch == 27:  # ESC
-                if self.current_file:
-                    self.current_file = None
-                    self.content = []
-                    self.cursor_y, self.cursor_x = 0, 0
-                    self.top_line = 0
-                else:
+            if ch != -1:
+                keys.append(ch)
+        return self.collect_pastes(keys)
+
+    def collect_pastes(self, keys):
+        # Replace every bracketed paste in keys with the pasted text as a
+        # single str. A paste may still be arriving, so keep reading until
+        # its end marker shows up.
+        events = []
+        i = 0
+        while i < len(keys):
+            if len(keys) - i < 6 and keys[i:] == PASTE_START[:len(keys) - i]:
+                # Possibly the start of a paste marker that is still arriving
+                self.screen.timeout(50)
+                ch = self.screen.getch()
+                if ch != -1:
+                    keys.append(ch)
+                    continue
+            if keys[i:i + 6] != PASTE_START:
+                events.append(keys[i])
+                i += 1
+                continue
+            i += 6
+            body = []
+            waiting = True
+            while i < len(keys) or waiting:
+                if waiting and len(keys) - i < 6:
+                    self.screen.timeout(500)
+                    ch = self.screen.getch()
+                    if ch != -1:
+                        keys.append(ch)
+                    else:
+                        waiting = False  # The end marker never came
+                    continue
+                if keys[i:i + 6] == PASTE_END:
+                    i += 6
                     break
-            elif ch == 10:  # Enter
-                if self.command_mode:
-                    self.execute_command()
-                    self.command_mode = False  # Exit command mode after executing command
-                elif not self.current_file:
-                    self.open_selected_file()
-                elif self.snippet_mode:
-                    self.expand_snippet()
-                    self.snippet_mode = False
-                    self.snippet_suggestions = []
-                    self.snippet_selection = 0
-                else:
-                    self.insert_char(ch)
-            elif ch == curses.KEY_UP:
-                if not self.current_file:
-                    self.move_file_selection(-1)
-                elif self.snippet_mode:
-                    self.move_snippet_selection(-1)
-                else:
-                    self.move_cursor(-1, 0)
-            elif ch == curses.KEY_DOWN:
-                if not self.current_file:
-                    self.move_file_selection(1)
-                elif self.snippet_mode:
-                    self.move_snippet_selection(1)
-                else:
-                    self.move_cursor(1, 0)
-            elif ch == curses.KEY_LEFT:
-                self.move_cursor(0, -1)
-            elif ch == curses.KEY_RIGHT:
-                self.move_cursor(0, 1)
-            elif ch == curses.KEY_PPAGE:  # Page Up
-                self.move_cursor(-curses.LINES + 1, 0)
-            elif ch == curses.KEY_NPAGE:  # Page Down
-                self.move_cursor(curses.LINES - 1, 0)
-            elif ch == curses.KEY_HOME:  # Home
-                self.cursor_x = 0
-            elif ch == curses.KEY_END:  # End
-                if self.cursor_y < len(self.content):
-                    self.cursor_x = len(self.content[self.cursor_y].rstrip())
-            elif ch == 19:  # CTRL+S
-                self.save_file()
-            elif ch == curses.KEY_F1 or ch == 16:  # F1 or CTRL+P
-                self.command_mode = True
-            elif ch == curses.KEY_BACKSPACE or ch == 127:  # Backspace
-                if self.command_mode:
-                    self.handle_command_backspace()
+                body.append(keys[i])
+                i += 1
+            text = bytes(k for k in body if k < 256).decode('utf-8', 'replace')
+            events.append(text.replace('\r\n', '\n').replace('\r', '\n'))
+        return events
+
+    def handle_keys(self, keys):
+        i = 0
+        while i < len(keys):
+            ch = keys[i]
+            editing = self.current_file and not self.command_mode and not self.output_pane and not self.finder_active
+            if isinstance(ch, str):
+                self.paste_text(ch)
+                i += 1
+            elif editing and not self.snippet_mode and ch in MOVE_KEYS:
+                # Collapse key-repeat bursts into a single move
+                run = 1
+                while i + run < len(keys) and keys[i + run] == ch:
+                    run += 1
+                if ch in (curses.KEY_PPAGE, curses.KEY_NPAGE):
+                    self.move_cursor(self.page_size(ch) * run, 0)
                 else:
-                    self.delete_char()
-            elif self.command_mode:
-                self.handle_command_input(ch)
-            elif self.current_file and 32 <= ch <= 126:  # Printable ASCII characters
-                self.insert_char(ch)
-                if self.config["snippets_enabled"]:
+                    self.move_cursor(MOVE_KEYS[ch][0] * run, MOVE_KEYS[ch][1] * run)
+                i += run
+            elif editing and isinstance(ch, int) and 32 <= ch <= 126:
+                # Insert a run of typed characters at once
+                run = 1
+                while i + run < len(keys) and isinstance(keys[i + run], int) and 32 <= keys[i + run] <= 126:
+                    run += 1
+                self.insert_text("".join(chr(k) for k in keys[i:i + run]))
+                if self.config["snippets_enabled"] or self.word_popup:
                     self.update_snippet_suggestions()
-            elif ch == 9:  # Tab
-                if self.config["tab_is"] == "SPC":
-                    for _ in range(self.config["tab_space_len"]):
-                        self.insert_char(32)
-                elif self.config["tab_is"] == "TAB":
-                    self.insert_char(9)
-
-            # Ensure the cursor is visible after any key press
-            curses.curs_set(1)  # Show the cursor
+                i += run
+            else:
+                if self.handle_key(ch) is False:
+                    return False
+                i += 1
 
-        self.cleanup()
+    def handle_key(self, ch):
+        if self.snippet_mode and ch in (curses.KEY_LEFT, curses.KEY_RIGHT, curses.KEY_PPAGE, curses.KEY_NPAGE, curses.KEY_HOME, curses.KEY_END):
+            self.close_suggestions()  # The cursor leaves the word being completed
+        if self.command_mode and ch == 27:
+            self.handle_command_input(ch)
+        elif self.finder_active and not self.command_mode:
+            self.handle_finder_key(ch)
+        elif self.output_pane and not self.command_mode:
+            self.handle_output_key(ch)
+        elif ch == 27:  # ESC
+            if self.current_file:
+                self.stash_buffer()  # The buffer stays open for "buffer <n>"
+            else:
+                return False
+        elif ch == 10:  # Enter
+            if self.command_mode:
+                if self.execute_command() is False:
+                    return False  # "exit"; run() restores the terminal
+                self.command_mode = False  # Exit command mode after executing command
+                self.command_buffer = []
+                self.renderer.invalidate()  # Commands may draw straight to the screen
+            elif not self.current_file:
+                self.open_selected_file()
+            elif self.snippet_mode:
+                self.expand_snippet()
+                self.close_suggestions()
+            else:
+                self.insert_char(ch)
+        elif ch == curses.KEY_UP:
+            if not self.current_file:
+                self.move_file_selection(-1)
+            elif self.snippet_mode:
+                self.move_snippet_selection(-1)
+            else:
+                self.move_cursor(-1, 0)
+        elif ch == curses.KEY_DOWN:
+            if not self.current_file:
+                self.move_file_selection(1)
+            elif self.snippet_mode:
+                self.move_snippet_selection(1)
+            else:
+                self.move_cursor(1, 0)
+        elif ch == curses.KEY_LEFT:
+            self.move_cursor(0, -1)
+        elif ch == curses.KEY_RIGHT:
+            self.move_cursor(0, 1)
+        elif ch in (curses.KEY_PPAGE, curses.KEY_NPAGE):  # Page Up / Page Down
+            if not self.current_file:
+                self.selected_file = max(0, min(len(self.files) - 1, self.selected_file + self.page_size(ch)))
+            else:
+                self.move_cursor(self.page_size(ch), 0)
+        elif ch == curses.KEY_HOME:  # Home
+            self.cursor_x = 0
+        elif ch == curses.KEY_END:  # End
+            if self.cursor_y < len(self.content):
+                self.cursor_x = self.content.line_length(self.cursor_y)
+        elif ch == 19:  # CTRL+S
+            self.save_file()
+        elif ch == 26 and self.current_file:  # CTRL+Z
+            self.undo()
+        elif ch == 25 and self.current_file:  # CTRL+Y
+            self.redo()
+        elif ch == curses.KEY_F1 or ch == 16:  # F1 or CTRL+P
+            self.command_mode = True
+        elif ch == 6 and self.current_file:  # CTRL+F
+            self.command_mode = True
+            self.command_buffer = ['/']
+            self.command_changed()
+        elif ch == 14 and self.current_file and self.words is not None:  # CTRL+N
+            self.word_popup = True
+            self.update_snippet_suggestions()
+            if not self.snippet_mode:
+                self.word_popup = False
+                self.status_message = "no completions"
+        elif (ch == 7 or ch == curses.KEY_F3) and self.current_file:  # CTRL+G or F3
+            self.search_next()
+        elif ch == curses.KEY_BACKSPACE or ch == 127:  # Backspace
+            if self.command_mode:
+                self.handle_command_backspace()
+            else:
+                self.delete_char()
+        elif self.command_mode:
+            self.handle_command_input(ch)
+        elif self.current_file and 32 <= ch <= 126:  # Printable ASCII characters
+            self.insert_char(ch)
+            if self.config["snippets_enabled"] or self.word_popup:
+                self.update_snippet_suggestions()
+        elif ch == 9:  # Tab
+            if self.snippet_fields:
+                self.next_snippet_field()
+            elif self.config["tab_is"] == "SPC":
+                self.insert_text(" " * self.config["tab_space_len"])
+            elif self.config["tab_is"] == "TAB":
+                self.insert_char(9)
 
-    def show_file_browser(self):
-        self.files = os.listdir('.')
-        self.selected_file = 0
+    def show_file_browser(self, select=None):
+        self.files = self.dir_cache.listing(os.getcwd())
         # Add ".." option to go to the parent directory
         if os.path.dirname(os.getcwd()):
-            self.files.insert(0, "..")
+            self.files = [("..", True)] + self.files
+        self.selected_file = 0
+        self.browser_top = 0
+        if select is not None:
+            self.selected_file = next((i for i, entry in enumerate(self.files) if entry[0] == select), 0)
 
     def display_file_browser(self):
-        self.screen.clear()
-        height, width = self.screen.getmaxyx()
-        for i, file in enumerate(self.files):
-            if i >= height - 1:
-                break
-            if i == self.selected_file:
-                self.screen.addstr(i, 0, f"> {file}", curses.A_REVERSE)
+        if self.files is None:
+            self.show_file_browser()
+        height, width = self.renderer.begin()
+        # Only the rows inside the viewport are formatted
+        rows = height - 1
+        if self.selected_file < self.browser_top:
+            self.browser_top = self.selected_file
+        elif self.selected_file >= self.browser_top + rows:
+            self.browser_top = self.selected_file - rows + 1
+        self.renderer.scroll_to(("browser", os.getcwd()), self.browser_top, rows)
+        for i in range(rows):
+            index = self.browser_top + i
+            if index >= len(self.files):
+                self.renderer.draw(i, ())
+                continue
+            name, is_dir = self.files[index]
+            if is_dir and name != "..":
+                name += "/"
+            if index == self.selected_file:
+                self.renderer.draw(i, ((0, f"> {name}", curses.A_REVERSE),))
             else:
-                self.screen.addstr(i, 0, f"  {file}")
+                self.renderer.draw(i, ((0, f"  {name}", 0),))
         if self.command_mode:
-            self.screen.addstr(height - 1, 0, ":" + "".join(self.command_buffer))
-        self.screen.refresh()
+            self.renderer.draw(height - 1, ((0, ":" + "".join(self.command_buffer), 0),))
+        else:
+            self.renderer.draw(height - 1, ((0, self.status_message, curses.A_DIM),))
+        self.renderer.finish()
 
     def move_file_selection(self, direction):
-        self.selected_file = (self.selected_file + direction) % len(self.files)
+        if self.files:
+            self.selected_file = (self.selected_file + direction) % len(self.files)
 
     def open_selected_file(self):
-        filename = self.files[self.selected_file]
+        if not self.files:
+            return
+        filename, is_dir = self.files[self.selected_file]
         if filename == "..":  # Go to the parent directory
+            previous = os.path.basename(os.getcwd())
             os.chdir("..")
-            self.show_file_browser()
-        elif os.path.isdir(filename):
+            self.show_file_browser(select=previous)
+        elif is_dir:
             os.chdir(filename)
             self.show_file_browser()
         else:
-            self.current_file = filename
-            if os.path.exists(filename):
-                with open(filename, 'r') as f:
-                    self.content = f.readlines()
-            else:
-                self.content = ['']
-            self.cursor_y, self.cursor_x = 0, 0
-            self.top_line = 0
+            self.open_file(filename)
+
+    def open_file(self, filename):
+        self.stash_buffer()
+        self.search = self.search_origin = None
+        document = self.buffers.pop(os.path.abspath(filename), None)
+        if document is not None:
+            signature = file_signature(filename)
+            if document.signature == signature or document.dirty():
+                if document.signature != signature:
+                    self.status_message = f"{filename} changed on disk since it was opened"
+                document.restore(self)
+                self.document = document
+                self.current_file = filename
+                return
+            document.close()  # Changed on disk, so it is read again
+        # Read the file before switching to it, so a file that cannot be
+        # read leaves the editor in the file browser
+        if os.path.exists(filename) and os.path.getsize(filename) >= self.config["large_file_mb"] * 1024 * 1024:
+            # Large files are memory-mapped and indexed in the background
+            self.content = TextBuffer(source=MappedFile(filename))
+        elif os.path.exists(filename):
+            lines, newline = read_lines(filename)
+            self.content = TextBuffer(lines, newline=newline)
+        else:
+            self.content = TextBuffer()
+        self.current_file = filename
+        self.journal = UndoJournal(self.content, self.config["undo_memory_kb"] * 1024)
+        self.document = Document(filename, self.content)
+        self.layout = Layout(self.content, self.config["tab_space_len"])
+        self.words = None
+        if self.config["word_completion"] and self.content.source is None:
+            self.words = WordIndex(self.content)
+        self.highlighter = None
+        lexer = LEXERS.get(os.path.splitext(filename)[1].lower())
+        if lexer and self.config["syntax_highlighting"] and self.content.source is None and self.token_colors():
+            self.highlighter = Highlighter(self.content, lexer())
+        if self.config["swap_files"]:
+            swap_path = self.swap_file(filename)
+            if os.path.exists(swap_path):
+                # Left behind by a crash; keep it aside until "recover"
+                os.replace(swap_path, swap_path + ".recover")
+            if os.path.exists(swap_path + ".recover"):
+                self.status_message = "unsaved changes from a crash were found, use 'recover' to restore them"
+            self.swap = SwapJournal(self.content, filename, swap_path)
+        self.snippet_fields = []
+        self.snippet_bounds = None
+        self.cursor_y, self.cursor_x = 0, 0
+        self.top_line = 0
+        self.left_col = 0
+
+    def token_colors(self):
+        if self.token_attrs is None:
+            self.term.start_color()
+            self.term.use_default_colors()
+            self.token_attrs = {}
+            if self.term.COLORS >= 8:
+                for color in set(TOKEN_COLORS.values()):
+                    self.term.init_pair(color, color, -1)
+                self.token_attrs = {kind: self.term.color_pair(color) for kind, color in TOKEN_COLORS.items()}
+        return self.token_attrs
+
+    def goto_line(self, line):
+        if line > len(self.content) and self.content.loading():
+            self.content.finish_loading()
+        self.cursor_y = min(max(line - 1, 0), len(self.content) - 1)
+        self.cursor_x = 0
+        self.top_line = max(0, self.cursor_y - self.screen.getmaxyx()[0] // 2)
+
+    def stash_buffer(self):
+        # Keep the open file in the buffer cache and show an empty buffer
+        if self.current_file is None:
+            return
+        self.wait_for_save()
+        self.document.stash(self)
+        self.buffers[self.document.path] = self.document
+        self.document = None
+        self.current_file = None
+        self.content = TextBuffer()
+        self.journal = self.highlighter = self.layout = self.words = self.swap = None
+        self.search = self.search_origin = None  # Matches of the old buffer mean nothing here
+        self.snippet_fields = []
+        self.snippet_bounds = None
+        self.cursor_y, self.cursor_x = 0, 0
+        self.top_line = 0
+        self.left_col = 0
+        self.evict_buffers()
+
+    def evict_buffers(self):
+        # Close the least recently used clean buffers until the cache fits
+        # its memory budget; buffers with unsaved changes are always kept
+        budget = self.config["buffer_cache_mb"] * 1024 * 1024
+        total = sum(document.memory() for document in self.buffers.values())
+        for path, document in list(self.buffers.items()):
+            if total <= budget:
+                break
+            if not document.dirty():
+                total -= document.memory()
+                del self.buffers[path]
+                document.close()
+
+    def buffer_list(self):
+        # The open buffer first, then the cached ones, most recent first
+        documents = list(reversed(self.buffers.values()))
+        return [self.document] + documents if self.document is not None else documents
+
+    def show_buffers(self):
+        lines = []
+        for i, document in enumerate(self.buffer_list(), 1):
+            marks = ("*" if document is self.document else " ") + ("+" if document.dirty() else " ")
+            content = self.content if document is self.document else document.state['content']
+            lines.append(f"{i:>3} {marks} {display_path(document.path)} ({len(content)} lines)")
+        self.show_lines(lines + ["", "* open  + unsaved changes, 'buffer <n>' switches"])
+
+    def switch_buffer(self, number):
+        documents = self.buffer_list()
+        if 1 <= number <= len(documents):
+            self.open_file(display_path(documents[number - 1].path))
+
+    def swap_file(self, filename):
+        swap_dir = os.path.join(config_dir(), "swap")
+        os.makedirs(swap_dir, exist_ok=True)
+        name = os.path.abspath(filename).replace(os.sep, '%').replace(':', '%')
+        return os.path.join(swap_dir, name + ".swp")
+
+    def recover(self):
+        recovery = self.swap_file(self.current_file) + ".recover"
+        if not os.path.exists(recovery):
+            self.status_message = "nothing to recover"
+            return
+        header, ops = read_swap(recovery)
+        if file_signature(self.current_file) != {"size": header["size"], "mtime": header["mtime"]}:
+            self.status_message = "the file changed since the unsaved changes were made, not recovering"
+            return
+        # Replay onto the file as it is on disk, as one undo step
+        filename = self.current_file
+        self.stash_buffer()
+        self.buffers.pop(os.path.abspath(filename)).close()
+        self.open_file(filename)
+        self.content.finish_loading()
+        self.journal.begin_group()
+        try:
+            for op, y, x, text in ops:
+                if op == 'insert':
+                    self.cursor_y, self.cursor_x = self.content.insert(y, x, text)
+                else:
+                    self.content.delete(y, x, *text_end(y, x, text))
+                    self.cursor_y, self.cursor_x = y, x
+        except IndexError:
+            self.status_message = "the unsaved changes do not fit the file, recovered what could be"
+        else:
+            self.status_message = f"recovered {len(ops)} edits, save to keep them"
+        self.journal.end_group()
+        os.remove(recovery)
+
+    def gutter(self, num):
+        # Line number strings are reused across frames instead of being
+        # formatted again for every row.
+        text = self.gutter_cache.get(num)
+        if text is None:
+            if len(self.gutter_cache) > 4096:
+                self.gutter_cache.clear()
+            text = self.gutter_cache[num] = f"{num:4d} "
+        return text
 
     def display_file(self):
-        self.screen.clear()
-        height, width = self.screen.getmaxyx()
-        status = f" {self.current_file} - Line {self.cursor_y + 1}/{len(self.content)} "
-        self.screen.addstr(height - 1, 0, status.ljust(width)[:width - 1], curses.A_REVERSE)
+        height, width = self.renderer.begin()
+        self.renderer.scroll_to(self.current_file, self.top_line, height - 1)
+        rows = [[] for _ in range(height - 1)]
+        if self.highlighter is not None:
+            self.highlighter.advance(self.highlight_target(), 0.005)
 
-        for i, line in enumerate(self.content[self.top_line:self.top_line + height - 1]):
-            line_num = i + self.top_line + 1
+        for i, line in enumerate(self.content.lines(self.top_line, self.top_line + height - 1)):
+            y = i + self.top_line
+            line_num = y + 1
             if self.config["number"]:
                 if self.config.get("relative_number", False):
                     if line_num == self.cursor_y + 1:
-                        self.screen.addstr(i, 0, f"{line_num:4d} ", curses.A_BOLD)
+                        rows[i].append((0, self.gutter(line_num), curses.A_BOLD))
                     else:
-                        rel_num = abs(line_num - self.cursor_y - 1)
-                        self.screen.addstr(i, 0, f"{rel_num:4d} ", curses.A_DIM)
+                        rows[i].append((0, self.gutter(abs(line_num - self.cursor_y - 1)), curses.A_DIM))
                 else:
-                    self.screen.addstr(i, 0, f"{line_num:4d} ", curses.A_DIM)
+                    rows[i].append((0, self.gutter(line_num), curses.A_DIM))
                 start_x = 5
             else:
                 start_x = 0
 
-            # Adjusting the display to avoid trailing spaces
-            line_display = line.rstrip()  # Remove trailing spaces for display
-            self.screen.addstr(i, start_x, line_display[:width - start_x - 1])
+            # Only the characters between left_col and the right edge are
+            # sliced, highlighted and searched
+            layout = self.layout.line(y, line)
+            first, last = self.layout.visible(layout, self.left_col, width - start_x - 1)
+            if first >= last:
+                continue
+            spans = [(first, last, 0)]
+            if self.highlighter is not None:
+                for start, end, kind in self.highlighter.line_spans(y, line):
+                    if start >= last:
+                        break
+                    if end > first:
+                        spans.append((max(start, first), min(end, last), self.token_attrs[kind]))
+            if self.search_pattern is not None:
+                for match in self.search_pattern.finditer(line, first, last):
+                    if match.end() > match.start():
+                        spans.append((match.start(), match.end(), curses.A_REVERSE))
+            if layout[2]:
+                for start, end, attr in spans:
+                    x, text = self.layout.segment(layout, start, end, self.left_col)
+                    rows[i].append((start_x + x, text, attr))
+            else:
+                # Without tabs or wide characters, columns are indexes
+                offset = start_x - self.left_col
+                rows[i] += [(offset + start, line[start:end], attr) for start, end, attr in spans]
 
         if self.command_mode:
-            self.screen.addstr(height - 2, 0, ":" + "".join(self.command_buffer))
+            rows[height - 2].append((0, ":" + "".join(self.command_buffer), 0))
         elif self.snippet_mode:
             for i, suggestion in enumerate(self.snippet_suggestions):
                 if i >= height - 2:
                     break
                 if i == self.snippet_selection:
-                    self.screen.addstr(i, 0, f"> {suggestion}", curses.A_REVERSE)
+                    rows[i].append((0, f"> {suggestion}", curses.A_REVERSE))
                 else:
-                    self.screen.addstr(i, 0, f"  {suggestion}")
+                    rows[i].append((0, f"  {suggestion}", 0))
+
+        for i, segments in enumerate(rows):
+            self.renderer.draw(i, segments)
+        status = f" {self.current_file} - Line {self.cursor_y + 1}/{len(self.content)} "
+        if self.content.loading():
+            status = f" {self.current_file} - Line {self.cursor_y + 1}/{len(self.content)}+ (indexing {self.content.source.progress()}%) "
+        if self.writer is not None:
+            status += f"(saving {self.writer.progress()}%) "
+        if self.search is not None:
+            status += f"(searching {self.search.progress()}%) "
+        if self.status_message:
+            status += f"- {self.status_message} "
+        self.renderer.draw(height - 1, ((0, status.ljust(width), curses.A_REVERSE),))
 
         cursor_y = self.cursor_y - self.top_line
-        cursor_x = self.cursor_x + (5 if self.config["number"] else 0)
+        cursor_x = self.cursor_column() - self.left_col + (5 if self.config["number"] else 0)
 
-        # Ensure cursor position is within bounds before moving
-        if 0 <= cursor_y < height - 1 and 0 <= cursor_x < width:
-            self.screen.move(cursor_y, cursor_x)
-        else:
-            # Reset cursor position if out of bounds
-            self.cursor_y = min(max(cursor_y, 0), height - 2)
-            self.cursor_x = min(max(cursor_x, 0), width - 1)
-            self.screen.move(self.cursor_y, self.cursor_x)
+        # Keep the terminal cursor on screen even if the text cursor is not
+        cursor_y = min(max(cursor_y, 0), height - 2)
+        cursor_x = min(max(cursor_x, 0), width - 1)
+        self.renderer.finish(cursor_y, cursor_x)
 
-        self.screen.refresh()
+    def highlight_target(self):
+        # Lines are highlighted up to the last text row on screen
+        return self.top_line + self.screen.getmaxyx()[0] - 1
+
+    def page_size(self, ch):
+        height, width = self.screen.getmaxyx()
+        return MOVE_KEYS[ch][0] * (height - 1)
 
     def move_cursor(self, dy, dx):
         new_y = max(0, min(len(self.content) - 1, self.cursor_y + dy))
-        new_x = max(0, min(len(self.content[new_y].rstrip()) if self.content else 0, self.cursor_x + dx))
+        new_x = max(0, min(self.content.line_length(new_y), self.cursor_x + dx))
         self.cursor_y, self.cursor_x = new_y, new_x
+        self.scroll_to_cursor()
 
+    def scroll_to_cursor(self):
         # Scroll the display if the cursor goes out of bounds
         height, width = self.screen.getmaxyx()
         if self.cursor_y >= self.top_line + height - 1:
             self.top_line = self.cursor_y - height + 2
         elif self.cursor_y < self.top_line:
             self.top_line = self.cursor_y
+        if self.layout is None:
+            return
+        column = self.cursor_column()
+        text_width = max(width - (5 if self.config["number"] else 0) - 1, 1)
+        if column < self.left_col:
+            self.left_col = max(column - text_width // 4, 0)
+        elif column >= self.left_col + text_width:
+            self.left_col = column - text_width * 3 // 4
 
-        self.display_file()
+    def cursor_column(self):
+        if self.layout is None or self.cursor_y >= len(self.content):
+            return self.cursor_x
+        return self.layout.column(self.layout.line(self.cursor_y, self.content.line(self.cursor_y)), self.cursor_x)
 
     def insert_char(self, ch):
-        if ch == ord('\n'):
-            self.content.insert(self.cursor_y + 1, self.content[self.cursor_y][self.cursor_x:])
-            self.content[self.cursor_y] = self.content[self.cursor_y][:self.cursor_x] + '\n'
-            self.cursor_y += 1
-            self.cursor_x = 0
-        else:
-            if not self.content:
-                self.content = ['']
-            line = self.content[self.cursor_y]
-            self.content[self.cursor_y] = line[:self.cursor_x] + chr(ch) + line[self.cursor_x:]
-            self.cursor_x += 1
+        self.insert_text(chr(ch))
+
+    def insert_text(self, text):
+        start = time.perf_counter()
+        self.cursor_y, self.cursor_x = self.content.insert(self.cursor_y, self.cursor_x, text)
+        self.stats.add('edit', time.perf_counter() - start)
+
+    def undo(self):
+        start = time.perf_counter()
+        cursor = self.journal.undo()
+        if cursor is not None:
+            self.cursor_y, self.cursor_x = cursor
+        self.stats.add('edit', time.perf_counter() - start)
+
+    def redo(self):
+        start = time.perf_counter()
+        cursor = self.journal.redo()
+        if cursor is not None:
+            self.cursor_y, self.cursor_x = cursor
+        self.stats.add('edit', time.perf_counter() - start)
+
+    def paste_text(self, text):
+        # A paste goes to whatever has the keyboard, like typed keys do
+        if self.command_mode:
+            self.command_buffer.extend(text.split('\n')[0])
+            self.command_changed()
+        elif self.finder_active:
+            self.finder_query.extend(text.split('\n')[0])
+        elif self.output_pane:
+            if self.output_search is not None:
+                self.output_search.extend(text.split('\n')[0])
+        elif self.current_file:
+            self.insert_text(text)
 
     def delete_char(self):
+        start = time.perf_counter()
         if self.cursor_x > 0:
-            line = self.content[self.cursor_y]
-            self.content[self.cursor_y] = line[:self.cursor_x - 1] + line[self.cursor_x:]
+            self.content.delete(self.cursor_y, self.cursor_x - 1, self.cursor_y, self.cursor_x)
             self.cursor_x -= 1
         elif self.cursor_y > 0:
             self.cursor_y -= 1
-            self.cursor_x = len(self.content[self.cursor_y].rstrip())
-            self.content[self.cursor_y] = self.content[self.cursor_y].rstrip() + self.content.pop(self.cursor_y + 1)
+            self.cursor_x = self.content.line_length(self.cursor_y)
+            self.content.delete(self.cursor_y, self.cursor_x, self.cursor_y + 1, 0)
+        self.stats.add('edit', time.perf_counter() - start)
 
     def save_file(self):
-        with open(self.current_file, 'w') as f:
-            f.writelines(self.content)
+        # The file is written on a background thread from a snapshot, so
+        # editing can go on while a large file is saved
+        self.wait_for_save()
+        if self.swap is not None:
+            self.swap.begin_save()
+        self.writer = FileWriter(self.current_file, self.content)
+        self.saving_version = self.document.version
+
+    def wait_for_save(self):
+        if self.writer is not None:
+            self.writer.wait()
+            self.poll_save()
+
+    def poll_save(self):
+        if self.writer is None or self.writer.running():
+            return
+        writer, self.writer = self.writer, None
+        if self.swap is not None:
+            self.swap.end_save(writer.error is None)
+        if writer.error is not None:
+            self.status_message = f"saving failed: {writer.error}"
+        else:
+            self.document.saved_version = self.saving_version
+            self.document.signature = file_signature(self.current_file)
+            self.status_message = f"saved {self.current_file}"
 
     def handle_command_input(self, ch):
         if ch == 27:  # ESC
             self.command_mode = False
             self.command_buffer = []
+            if self.search_origin is not None:
+                self.cancel_search()
         elif 32 <= ch <= 126:  # Printable ASCII characters
             self.command_buffer.append(chr(ch))
+            self.command_changed()
 
     def handle_command_backspace(self):
         if self.command_buffer:
             self.command_buffer.pop()
+            self.command_changed()
+
+    def command_changed(self):
+        # A command starting with / searches while it is typed
+        if self.command_buffer[:1] == ['/'] and self.current_file:
+            if self.search_origin is None:
+                self.search_origin = (self.cursor_y, self.cursor_x, self.top_line, self.left_col)
+            self.cursor_y, self.cursor_x, self.top_line, self.left_col = self.search_origin
+            query = "".join(self.command_buffer[1:])
+            self.search_pattern = compile_search(query) if query else None
+            self.search = BufferSearch(self.content, self.search_pattern, self.cursor_y, self.cursor_x) if query else None
+        elif self.search_origin is not None:
+            self.cancel_search()
+
+    def cancel_search(self):
+        self.cursor_y, self.cursor_x, self.top_line, self.left_col = self.search_origin
+        self.search_origin = None
+        self.search = None
+        self.search_pattern = None
+
+    def search_next(self):
+        if self.search_pattern is not None:
+            self.search = BufferSearch(self.content, self.search_pattern, self.cursor_y, self.cursor_x + 1)
+
+    def step_search(self):
+        if self.search is None:
+            return
+        self.search.step(0.008)
+        if self.search.match is not None:
+            self.cursor_y, self.cursor_x, _ = self.search.match
+            if self.search.wrapped:
+                self.status_message = "search wrapped around"
+            self.search = None
+        elif self.search.done():
+            self.status_message = f"no match for {self.search.pattern.pattern}"
+            self.search = None
+
+    def replace_all(self, pattern, replacement):
+        # Lines with matches are replaced in runs, one delete and one insert
+        # per run, and the whole replace is a single undo step
+        self.content.finish_loading()
+        runs, count, lines = [], 0, 0
+        for y, line in enumerate(self.content.iter_lines()):
+            body = line[:-1] if line.endswith('\n') else line
+            new, found = pattern.subn(replacement, body)
+            if not found:
+                continue
+            count += found
+            lines += 1
+            if runs and y - runs[-1][1] <= REPLACE_GAP:
+                # Close enough to the previous run to share its edit
+                run = runs[-1]
+                run[2] += [l[:-1] if l.endswith('\n') else l for l in self.content.lines(run[1] + 1, y)]
+                run[1] = y
+                run[2].append(new)
+            else:
+                runs.append([y, y, [new]])
+        self.journal.begin_group()
+        for first, last, new_lines in reversed(runs):
+            self.content.delete(first, 0, last, self.content.line_length(last))
+            self.content.insert(first, 0, "\n".join(new_lines))
+        self.journal.end_group()
+        self.cursor_y = min(self.cursor_y, len(self.content) - 1)
+        self.cursor_x = min(self.cursor_x, self.content.line_length(self.cursor_y))
+        return count, lines
 
     def execute_command(self):
-        command = "".join(self.command_buffer).strip().split()
+        text = "".join(self.command_buffer)
+        if text.startswith("/"):
+            # The search already ran while it was typed; keep its match
+            self.search_origin = None
+            return
+        command = text.strip().split()
         if not command:
             self.command_mode = False
             self.command_buffer = []
@@ -310,22 +2642,21 @@ class TinyEditor:
         elif command[0] == "create" and len(command) > 1:
             filename = command[1]
             open(filename, 'a').close()  # Create an empty file
-            self.files = os.listdir('.')  # Refresh file list
+            self.dir_cache.invalidate(os.getcwd())  # Refresh file list
             self.show_file_browser()  # Show updated file browser
-            self.screen.addstr(curses.LINES - 2, 0, f"File '{filename}' created successfully")
+            self.screen.addstr(self.screen.getmaxyx()[0] - 2, 0, f"File '{filename}' created successfully")
             self.screen.refresh()
-            curses.napms(2000)
+            self.term.napms(2000)
         elif command[0] == "mkdir" and len(command) > 1:  # Create a new directory
             dirname = command[1]
             os.makedirs(dirname, exist_ok=True)
-            self.files = os.listdir('.')  # Refresh file list
+            self.dir_cache.invalidate(os.getcwd())  # Refresh file list
             self.show_file_browser()  # Show updated file browser
-            self.screen.addstr(curses.LINES - 2, 0, f"Directory '{dirname}' created successfully")
+            self.screen.addstr(self.screen.getmaxyx()[0] - 2, 0, f"Directory '{dirname}' created successfully")
             self.screen.refresh()
-            curses.napms(2000)
+            self.term.napms(2000)
         elif command[0] == "exit":
-            self.cleanup()
-            sys.exit(0)
+            return False
         elif command[0] == "number":
             self.config["number"] = not self.config["number"]
             self.save_config()
@@ -334,157 +2665,349 @@ class TinyEditor:
                 self.config["relative_number"] = not self.config["relative_number"]
                 self.save_config()
             else:
-                self.screen.addstr(curses.LINES - 2, 0, "Error: 'number' must be enabled for 'relativenumber'")
+                self.screen.addstr(self.screen.getmaxyx()[0] - 2, 0, "Error: 'number' must be enabled for 'relativenumber'")
                 self.screen.refresh()
-                curses.napms(2000)
+                self.term.napms(2000)
         elif command[0] == "explosion":
             self.trigger_explosion()
         elif command[0] == "com":
-            self.execute_terminal_command()
+            self.execute_terminal_command("".join(self.command_buffer).strip()[3:].strip())
             self.command_mode = False  # Reset command mode after executing command
             self.command_buffer = []   # Clear command buffer
-            # Ensure cursor is within bounds after terminal command execution
-            if self.content:  # Check if content is not empty
-                self.cursor_y = min(self.cursor_y, len(self.content) - 1)  # Ensure cursor is within bounds
-                self.cursor_x = min(self.cursor_x, len(self.content[self.cursor_y].rstrip()) if self.cursor_y < len(self.content) else 0)  # Ensure cursor is within line
-            self.display_file()  # Refresh display after returning from command mode
+        elif command[0] == "find":
+            self.open_finder("".join(self.command_buffer).strip()[4:].strip())
+        elif command[0] == "replace" and len(command) > 1 and self.current_file:
+            # replace <pattern> [replacement], the replacement may contain spaces
+            parts = text.strip().split(None, 2)
+            try:
+                count, lines = self.replace_all(compile_search(parts[1]), parts[2] if len(parts) > 2 else "")
+                self.status_message = f"replaced {count} matches on {lines} lines"
+            except re.error as e:
+                self.status_message = f"replace failed: {e}"
+        elif command[0] == "recover" and self.current_file:
+            self.recover()
+        elif command[0] == "stats":
+            self.show_lines(self.stats.report())
+        elif command[0] == "buffers":
+            self.show_buffers()
+        elif command[0] == "buffer" and len(command) > 1 and command[1].isdigit():
+            self.switch_buffer(int(command[1]))
+        elif command[0] == "jobs":
+            if self.jobs:
+                self.show_output(len(self.jobs) - 1)
+        elif command[0] == "job" and len(command) > 1 and command[1].isdigit():
+            if 1 <= int(command[1]) <= len(self.jobs):
+                self.show_output(int(command[1]) - 1)
         elif command[0] == "rmdir" and len(command) > 1:  # Remove a directory
             dirname = command[1]
             try:
                 os.system("rm -rf {}".format(dirname))
-                self.files = os.listdir('.')  # Refresh file list
+                self.dir_cache.invalidate(os.getcwd())  # Refresh file list
                 self.show_file_browser()  # Show updated file browser
-                self.screen.addstr(curses.LINES - 2, 0, f"Directory '{dirname}' removed successfully")
+                self.screen.addstr(self.screen.getmaxyx()[0] - 2, 0, f"Directory '{dirname}' removed successfully")
                 self.screen.refresh()
-                curses.napms(2000)
+                self.term.napms(2000)
             except OSError as e:
-                self.screen.addstr(curses.LINES - 2, 0, f"Error: {e}")
+                self.screen.addstr(self.screen.getmaxyx()[0] - 2, 0, f"Error: {e}")
                 self.screen.refresh()
-                curses.napms(2000)
+                self.term.napms(2000)
         elif command[0] == "rmfile" and len(command) > 1:  # Remove a file
             filename = command[1]
             try:
                 os.remove(filename)
-                self.files = os.listdir('.')  # Refresh file list
+                self.dir_cache.invalidate(os.getcwd())  # Refresh file list
                 self.show_file_browser()  # Show updated file browser
-                self.screen.addstr(curses.LINES - 2, 0, f"File '{filename}' removed successfully")
+                self.screen.addstr(self.screen.getmaxyx()[0] - 2, 0, f"File '{filename}' removed successfully")
                 self.screen.refresh()
-                curses.napms(2000)
+                self.term.napms(2000)
             except OSError as e:
-                self.screen.addstr(curses.LINES - 2, 0, f"Error: {e}")
+                self.screen.addstr(self.screen.getmaxyx()[0] - 2, 0, f"Error: {e}")
                 self.screen.refresh()
-                curses.napms(2000)
+                self.term.napms(2000)
 
     def trigger_explosion(self):
+        if self.current_file is None:
+            return
+        # The text as it is on screen now, for the frame where it falls
         height, width = self.screen.getmaxyx()
-        center_y, center_x = self.cursor_y, self.cursor_x
-        radius = 1
-        speed = 0.1  # Increased speed for the explosion effect
-
-        # Create explosion effect
-        while radius < max(height, width):
-            self.screen.clear()
-            for y in range(height):
-                for x in range(width):
-                    if (y - center_y) ** 2 + (x - center_x) ** 2 <= radius ** 2:
-                        if y < len(self.content):  # Check if within content bounds
-                            self.screen.addstr(y, x, " ", curses.A_REVERSE)
-                    else:
-                        if y < len(self.content):
-                            line_display = self.content[y].rstrip()
-                            self.screen.addstr(y, 0, line_display[:width])
-            self.screen.refresh()
-            time.sleep(speed)  # Use the new speed variable
-            radius += 2  # Increase the radius more quickly
+        start_x = 5 if self.config["number"] else 0
+        rows = []
+        for i, line in enumerate(self.content.lines(self.top_line, self.top_line + height - 1)):
+            layout = self.layout.line(self.top_line + i, line)
+            first, last = self.layout.visible(layout, self.left_col, width - start_x - 1)
+            x, text = self.layout.segment(layout, first, last, self.left_col) if first < last else (0, "")
+            rows.append(" " * x + text)
+        center_y = self.cursor_y - self.top_line
+        center_x = self.cursor_column() - self.left_col + start_x
+        self.animation = Animation(explosion_frames(rows, height, width, center_y, center_x))
 
-        # Characters start to reappear
-        time.sleep(2)
-
-        # Move content to the bottom
-        self.screen.clear()
-        for i in range(len(self.content)):
-            if i < height - 5:
-                self.screen.addstr(min(height - 5 + i, height - 1), 0, self.content[i].rstrip())
-        
-        self.screen.addstr(height - 1, 0, "Characters have fallen to the bottom!")
-        self.screen.refresh()
-        time.sleep(5)
-
-        # Reset the display
-        self.screen.clear()
+    def step_animation(self):
+        if self.animation.play(self.screen, self.term):
+            return
+        self.animation = None
+        self.renderer.invalidate()
+        self.status_message = "Explosion effect completed!"
         self.display_file()
-        self.screen.addstr(height - 1, 0, "Explosion effect completed!")
-        self.screen.refresh()
-        time.sleep(2)
 
-    def execute_terminal_command(self):
-        curses.echo()
-        curses.curs_set(1)
+    def show_lines(self, lines):
         height, width = self.screen.getmaxyx()
-        self.screen.addstr(height - 2, 0, "Enter command: ")
-        self.screen.refresh()
-        command = self.screen.getstr(height - 2, 16).decode('utf-8')
-        
-        try:
-            output = subprocess.check_output(command, shell=True, stderr=subprocess.STDOUT, universal_newlines=True)
-        except subprocess.CalledProcessError as e:
-            output = e.output
-        
         self.screen.clear()
-        self.screen.addstr(0, 0, "Command output:")
-        for i, line in enumerate(output.split('\n')):
-            if i >= height - 3:
-                break
-            self.screen.addstr(i + 1, 0, line[:width - 1])
-        
-        self.screen.addstr(height - 1, 0, "Press any key to continue...")
+        lines = lines + ["", "Press any key to continue"]
+        for i, line in enumerate(lines[:height - 1]):
+            self.screen.addstr(i, 0, line[:width - 1])
         self.screen.refresh()
+        self.screen.timeout(-1)
         self.screen.getch()
-        
-        curses.noecho()
-        curses.curs_set(0)
 
-    def save_config(self):
-        if platform.system() == "Windows":
-            config_file = os.path.join(os.environ["APPDATA"], "tindit", "init.json")
+    def execute_terminal_command(self, command=""):
+        if not command:
+            self.term.echo()
+            self.term.curs_set(1)
+            height, width = self.screen.getmaxyx()
+            self.screen.addstr(height - 2, 0, "Enter command: ")
+            self.screen.refresh()
+            self.screen.timeout(-1)
+            command = self.screen.getstr(height - 2, 16).decode('utf-8')
+            self.term.noecho()
+        if command.strip():
+            # The command runs in the background; its output streams into the pane
+            self.jobs.append(Job(len(self.jobs) + 1, command, self.config["job_output_lines"]))
+            self.show_output(len(self.jobs) - 1)
+
+    def open_finder(self, query=""):
+        # The index covers the enclosing git work tree, or the cwd outside one
+        root = os.getcwd()
+        while not os.path.isdir(os.path.join(root, '.git')) and os.path.dirname(root) != root:
+            root = os.path.dirname(root)
+        if not os.path.isdir(os.path.join(root, '.git')):
+            root = os.getcwd()
+        if self.file_index is None or self.file_index.root != root:
+            if self.file_index is not None:
+                self.file_index.close()
+            self.file_index = FileIndex(root)
+        self.file_index.active = True
+        self.file_index.wake.set()  # Look for changes right away
+        self.finder_active = True
+        self.finder_query = list(query)
+        self.finder_selection = 0
+        self.finder_search = FuzzySearch(query, self.file_index.paths, self.file_index.version)
+
+    def update_finder(self):
+        index = self.file_index
+        query = "".join(self.finder_query)
+        search = self.finder_search
+        if query != search.query or index.version != search.version:
+            search = search.narrow(query, index.version) if not index.building else None
+            self.finder_search = search or FuzzySearch(query, index.paths, index.version)
+            self.finder_selection = 0
+        self.finder_search.step(0.012)
+
+    def handle_finder_key(self, ch):
+        results = self.finder_search.results()
+        if ch == 27:  # ESC
+            self.finder_active = False
+            self.file_index.active = False
+        elif ch == 10:  # Enter
+            if results:
+                path = results[min(self.finder_selection, len(results) - 1)]
+                self.finder_active = False
+                self.file_index.active = False
+                self.open_file(os.path.relpath(self.file_index.full_path(path)))
+        elif ch in (curses.KEY_UP, curses.KEY_DOWN):
+            if results:
+                self.finder_selection = (self.finder_selection + MOVE_KEYS[ch][0]) % len(results)
+        elif ch in (curses.KEY_BACKSPACE, 127):
+            if self.finder_query:
+                self.finder_query.pop()
+        elif ch == curses.KEY_F1 or ch == 16:  # F1 or CTRL+P
+            self.command_mode = True
+        elif 32 <= ch <= 126:
+            self.finder_query.append(chr(ch))
+
+    def display_finder(self):
+        height, width = self.renderer.begin()
+        search = self.finder_search
+        results = search.results()
+        state = "indexing, " if self.file_index.building else ""
+        state += "" if search.done() else f"{100 * search.pos // max(1, len(search.candidates))}%, "
+        info = f"  ({state}{len(search.matches)} of {len(self.file_index.paths)} files)"
+        query = "find> " + "".join(self.finder_query)
+        self.renderer.scroll_to("finder", 0, height - 1)
+        self.renderer.draw(0, ((0, query, 0), (len(query), info, curses.A_DIM)))
+        for i in range(1, height - 1):
+            if i - 1 >= len(results):
+                self.renderer.draw(i, ())
+            elif i - 1 == self.finder_selection:
+                self.renderer.draw(i, ((0, f"> {results[i - 1]}", curses.A_REVERSE),))
+            else:
+                self.renderer.draw(i, ((0, f"  {results[i - 1]}", 0),))
+        if self.command_mode:
+            self.renderer.draw(height - 1, ((0, ":" + "".join(self.command_buffer), 0),))
+        else:
+            self.renderer.draw(height - 1, ((0, self.status_message or "ESC close  UP/DOWN select  ENTER open", curses.A_DIM),))
+        self.renderer.finish(0, min(len(query), width - 1))
+
+    def show_output(self, index):
+        self.output_pane = True
+        self.output_job = index
+        self.output_top = None
+        self.output_search = None
+
+    def poll_jobs(self):
+        for job in self.jobs:
+            if not job.running() and not job.reported:
+                job.reported = True
+                self.status_message = f"job {job.number} '{job.command}' exited with {job.returncode}"
+
+    def handle_output_key(self, ch):
+        job = self.jobs[self.output_job]
+        height, width = self.screen.getmaxyx()
+        rows = height - 2
+        top = self.output_top if self.output_top is not None else max(0, len(job.lines) - rows)
+        if self.output_search is not None:
+            if ch == 10:
+                self.output_pattern = "".join(self.output_search)
+                self.output_search = None
+                self.find_in_output(job, top)
+            elif ch == 27:
+                self.output_search = None
+            elif ch in (curses.KEY_BACKSPACE, 127):
+                if self.output_search:
+                    self.output_search.pop()
+            elif 32 <= ch <= 126:
+                self.output_search.append(chr(ch))
+        elif ch == 27:  # ESC hides the pane, the job keeps running
+            self.output_pane = False
+        elif ch == curses.KEY_F1 or ch == 16:  # F1 or CTRL+P
+            self.command_mode = True
+        elif ch == 3:  # CTRL+C
+            job.kill()
+        elif ch in (curses.KEY_LEFT, curses.KEY_RIGHT):
+            self.show_output((self.output_job + MOVE_KEYS[ch][1]) % len(self.jobs))
+        elif ch in (curses.KEY_UP, curses.KEY_DOWN, curses.KEY_PPAGE, curses.KEY_NPAGE):
+            step = MOVE_KEYS[ch][0] * (rows if ch in (curses.KEY_PPAGE, curses.KEY_NPAGE) else 1)
+            self.output_top = max(0, min(top + step, max(0, len(job.lines) - rows)))
+        elif ch == curses.KEY_HOME:
+            self.output_top = 0
+        elif ch == curses.KEY_END:
+            self.output_top = None
+        elif ch == ord('/'):
+            self.output_search = []
+        elif ch == ord('n') and self.output_pattern:
+            self.find_in_output(job, top)
+
+    def find_in_output(self, job, top):
+        found = job.find(self.output_pattern, top + 1)
+        if found is None:
+            self.status_message = f"'{self.output_pattern}' not found"
+        else:
+            self.output_top = found
+
+    def display_output(self):
+        height, width = self.renderer.begin()
+        job = self.jobs[self.output_job]
+        rows = height - 2
+        top = self.output_top if self.output_top is not None else max(0, len(job.lines) - rows)
+        self.renderer.scroll_to(("job", job.number), top, rows)
+        state = "running" if job.running() else f"exit {job.returncode}"
+        dropped = f", {job.received - len(job.lines)} dropped" if job.received > len(job.lines) else ""
+        title = f" [job {job.number}/{len(self.jobs)}] {job.command} ({state}, {job.received} lines{dropped}) "
+        self.renderer.draw(0, ((0, title.ljust(width), curses.A_REVERSE),))
+        lines = job.window(top, rows)
+        for i in range(rows):
+            line = lines[i] if i < len(lines) else ""
+            if self.output_pattern and self.output_pattern in line:
+                self.renderer.draw(i + 1, ((0, line, 0), (line.index(self.output_pattern), self.output_pattern, curses.A_REVERSE)))
+            else:
+                self.renderer.draw(i + 1, ((0, line, 0),))
+        if self.command_mode:
+            footer = ((0, ":" + "".join(self.command_buffer), 0),)
+        elif self.output_search is not None:
+            footer = ((0, "/" + "".join(self.output_search), 0),)
         else:
-            config_file = os.path.expanduser("~/.config/tindit/init.json")
+            footer = ((0, self.status_message or "ESC close  ^C kill  <-/-> jobs  / search  n next", curses.A_DIM),)
+        self.renderer.draw(height - 1, footer)
+        self.renderer.finish()
+
+    def save_config(self):
+        config_file = os.path.join(config_dir(), "init.json")
         with open(config_file, 'w') as f:
             json.dump(self.config, f)
 
     def handle_snippet_expansion(self):
         if self.current_file:
-            current_line = self.content[self.cursor_y].rstrip()
-            for snippet_name, snippet_content in self.snippets.items():
+            if self.snippets is None:
+                self.snippets = self.load_snippets()
+            current_line = self.content.line(self.cursor_y).rstrip()
+            for snippet_name in self.snippet_index.suffix_matches(current_line):
                 if current_line.endswith(snippet_name):
-                    # Split the snippet content into lines
-                    snippet_lines = snippet_content.splitlines()
-                    # Calculate the insertion point for each line
-                    insertion_point = self.cursor_y
-                    for i, line in enumerate(snippet_lines):
-                        self.content.insert(insertion_point + i + 1, line)
-                    # Replace the snippet name with the first line of the snippet
-                    self.content[self.cursor_y] = current_line.replace(snippet_name, snippet_lines[0], 1)
-                    # Adjust cursor position
-                    self.cursor_y += len(snippet_lines) - 1
-                    self.cursor_x = len(self.content[self.cursor_y].rstrip())
+                    # Replace the snippet name with the snippet content
+                    start_x = len(current_line) - len(snippet_name)
+                    self.content.delete(self.cursor_y, start_x, self.cursor_y, len(current_line))
+                    self.cursor_y, self.cursor_x = self.content.insert(self.cursor_y, start_x, self.snippets[snippet_name].rstrip('\n'))
                     self.display_file()
                     break
 
     def update_snippet_suggestions(self):
+        # Snippet names first, then words from the open buffers
+        if self.config["snippets_enabled"] and self.snippets is None:
+            self.snippets = self.load_snippets()
+        start = time.perf_counter()
+        suggestions = []
         if self.config["snippets_enabled"]:
-            current_line = self.content[self.cursor_y].rstrip()
-            self.snippet_suggestions = [
-                snippet_name for snippet_name in self.snippets
-                if current_line.endswith(snippet_name) or snippet_name.startswith(current_line)
-            ]
-            if self.snippet_suggestions:
-                self.snippet_mode = True
-                self.snippet_selection = 0
-            else:
-                self.snippet_mode = False
-                self.snippet_suggestions = []
-                self.snippet_selection = 0
+            current_line = self.content.line(self.cursor_y).rstrip()
+            suggestions = self.snippet_index.suggest(current_line)
+        if self.word_popup and self.words is not None:
+            suggestions += [word for word in self.word_suggestions() if word not in suggestions]
+        self.snippet_suggestions = suggestions[:self.config["snippet_suggestions_max"]]
+        self.stats.add('snippet', time.perf_counter() - start)
+        if self.snippet_suggestions:
+            self.snippet_mode = True
+            self.snippet_selection = 0
+        else:
+            self.close_suggestions()
+
+    def close_suggestions(self):
+        self.snippet_mode = False
+        self.snippet_suggestions = []
+        self.snippet_selection = 0
+        self.word_popup = False
+
+    def word_prefix(self):
+        line = self.content.line(self.cursor_y)
+        match = WORD_TAIL.search(line, max(0, self.cursor_x - 64), self.cursor_x)
+        return match.group() if match else ""
+
+    def word_suggestions(self):
+        # The open buffer ranks by distance from the cursor too; the most
+        # recently used other buffers add their most frequent words
+        prefix = self.word_prefix()
+        if len(prefix) < 2:
+            return []
+        limit = self.config["snippet_suggestions_max"]
+        words = self.words.complete(prefix, self.cursor_y, limit)
+        for other in self.word_indexes()[1:]:
+            if len(words) < limit:
+                words += [word for word in other.complete(prefix, limit=limit) if word not in words]
+        return words[:limit]
+
+    def word_indexes(self):
+        # The open buffer's WordIndex and those of the recent buffers
+        indexes = [self.words] if self.words is not None else []
+        for document in islice(reversed(self.buffers.values()), RECENT_BUFFERS):
+            if document.state.get('words') is not None:
+                indexes.append(document.state['words'])
+        return indexes
+
+    def step_words(self):
+        for words in self.word_indexes():
+            if not words.done():
+                words.advance(0.004)
+                break
+
+    def complete_word(self, word):
+        prefix = self.word_prefix()
+        self.cursor_y, self.cursor_x = self.content.insert(self.cursor_y, self.cursor_x, word[len(prefix):])
 
     def move_snippet_selection(self, direction):
         self.snippet_selection = (self.snippet_selection + direction) % len(self.snippet_suggestions)
@@ -492,30 +3015,92 @@ class TinyEditor:
     def expand_snippet(self):
         if self.snippet_suggestions:
             snippet_name = self.snippet_suggestions[self.snippet_selection]
-            snippet_content = self.snippets[snippet_name]
-            # Insert snippet content into the file character by character
-            self.content[self.cursor_y] = ""
-            for char in snippet_content:
-                if char == '\n':
-                    self.content.insert(self.cursor_y + 1, self.content[self.cursor_y][self.cursor_x:])
-                    self.content[self.cursor_y] = self.content[self.cursor_y][:self.cursor_x] + '\n'
-                    self.cursor_y += 1
-                    self.cursor_x = 0
-                else:
-                    self.content[self.cursor_y] += char
-                    self.cursor_x += 1
-                self.display_file()
-            # Adjust cursor position
-            self.cursor_x = len(self.content[self.cursor_y].rstrip())
-            # Update the display
-            self.display_file()
+            if self.snippets is None or snippet_name not in self.snippets:
+                self.complete_word(snippet_name)
+                return
+            text, fields = parse_snippet(self.snippets[snippet_name])
+            # Replace the part of the snippet name that was already typed
+            before = self.content.line(self.cursor_y)[:self.cursor_x]
+            typed = next((k for k in range(len(snippet_name), 0, -1) if before.endswith(snippet_name[:k])), 0)
+            start_y, start_x = self.cursor_y, self.cursor_x - typed
+            self.journal.begin_group()  # Undo removes the snippet and restores the typed name
+            self.content.delete(start_y, start_x, start_y, self.cursor_x)
+            # Insert the whole snippet in one buffer operation
+            self.cursor_y, self.cursor_x = self.content.insert(start_y, start_x, text)
+            self.journal.end_group()
+            self.drop_snippet_fields()
+            for offset, number in fields:
+                head = text[:offset]
+                newlines = head.count('\n')
+                x = len(head) - head.rfind('\n') - 1 if newlines else start_x + len(head)
+                self.snippet_fields.append([start_y + newlines, x])
+            self.snippet_bounds = [[start_y, start_x], [self.cursor_y, self.cursor_x]]
+            self.content.marks.extend(self.snippet_fields)
+            self.content.marks.extend(self.snippet_bounds)
+            self.next_snippet_field()
+
+    def next_snippet_field(self):
+        # Jump to the next tab stop of the last expanded snippet
+        if self.snippet_fields:
+            mark = self.snippet_fields.pop(0)
+            self.content.marks = [other for other in self.content.marks if other is not mark]
+            self.cursor_y, self.cursor_x = mark
+        if not self.snippet_fields:
+            self.drop_snippet_fields()
+
+    def check_snippet_fields(self):
+        # Tab stops only apply while the cursor stays inside the snippet;
+        # the end mark does not move for text typed right at it, so the
+        # remaining fields count as inside too
+        start, end = self.snippet_bounds
+        end = max([tuple(end)] + [tuple(mark) for mark in self.snippet_fields])
+        if not tuple(start) <= (self.cursor_y, self.cursor_x) <= end:
+            self.drop_snippet_fields()
+
+    def drop_snippet_fields(self):
+        marks = self.snippet_fields + (self.snippet_bounds or [])
+        self.content.marks = [mark for mark in self.content.marks if not any(mark is other for other in marks)]
+        self.snippet_fields = []
+        self.snippet_bounds = None
 
     def cleanup(self):
-        curses.nocbreak()
+        self.set_bracketed_paste(False)
+        self.stash_buffer()
+        for document in self.buffers.values():
+            document.close()
+        for job in self.jobs:
+            if job.running():
+                job.kill()  # Jobs run in their own session, so nothing else stops them
+        if self.file_index is not None:
+            self.file_index.close()
+        self.stats.close()
+        self.term.noraw()
         self.screen.keypad(False)
-        curses.echo()
-        curses.endwin()
+        self.term.echo()
+        self.term.endwin()
 
-if __name__ == "__main__":
-    editor = TinyEditor()
+def parse_target(arg):
+    # "path:line" opens path at line, unless a file with that exact name exists
+    match = re.match(r'(.+):(\d+)$', arg)
+    if match and not os.path.exists(arg):
+        return match.group(1), int(match.group(2))
+    return arg, None
+
+def main(argv=None, term=curses):
+    argv = sys.argv[1:] if argv is None else argv
+    editor = TinyEditor(term)
+    if argv:
+        path, line = parse_target(argv[0])
+        if os.path.isdir(path):
+            os.chdir(path)
+        else:
+            try:
+                editor.open_file(path)
+                if line is not None:
+                    editor.goto_line(line)
+            except (OSError, UnicodeDecodeError) as error:
+                editor.status_message = f"could not open {path}: {error}"
     editor.run()
+
+if __name__ == "__main__":
+    main()